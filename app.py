@@ -7,21 +7,29 @@ import gradio as gr
 from google import genai
 from google.genai import types
 import os
+import sys
+import argparse
 import tempfile
+import shutil
 import wave
 import time
+import random
+import subprocess
+import threading
+import contextvars
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from pdf2image import convert_from_path
-from PIL import Image
 import numpy as np
-from pydub import AudioSegment
-from moviepy import ImageClip, AudioFileClip, concatenate_videoclips, VideoFileClip
+from moviepy import concatenate_videoclips, VideoFileClip
 import fitz  # PyMuPDF
-from huggingface_hub import HfApi
+from huggingface_hub import HfApi, CommitOperationAdd
 import datetime
 import json
 import re
 import traceback
+import hashlib
+from contextlib import contextmanager
 from pydantic import BaseModel
 from typing import List
 
@@ -57,38 +65,415 @@ class ScriptResponseMulti(BaseModel):
     pages: List[PageScriptMulti]
 
 
+# ===========================
+# 計測
+# ===========================
+_TRACE_LOCAL = threading.local()  # 実行中ステージの記録（スレッドごと）
+TRACE_COUNTERS = ("bytes", "requests", "retry_wait", "quota_wait", "cache_hits", "cache_misses")
+
+
+class RunTrace:
+    """1回の変換のステージ別計測（壁時計時間・バイト数・リクエスト数・待機・キャッシュ）
+
+    stage() の中で行われたAPI呼び出し・リトライ待機・キャッシュ参照は、
+    同じスレッドで実行中のステージ記録に自動で加算される。
+    """
+
+    def __init__(self, job_id=""):
+        self.job_id = job_id
+        self.started_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self.started = time.perf_counter()
+        self.records = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, page=None):
+        record = {"stage": name, "page": page}
+        parent = getattr(_TRACE_LOCAL, "record", None)
+        _TRACE_LOCAL.record = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            for counter in ("retry_wait", "quota_wait"):
+                if counter in record:
+                    record[counter] = round(record[counter], 3)
+            _TRACE_LOCAL.record = parent
+            with self.lock:
+                self.records.append(record)
+
+    def summary(self):
+        """ステージごとの件数・合計/最大時間・各カウンタの合計"""
+        stages = {}
+        with self.lock:
+            records = list(self.records)
+        for record in records:
+            entry = stages.setdefault(record["stage"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += record["seconds"]
+            entry["max_seconds"] = max(entry["max_seconds"], record["seconds"])
+            for counter in TRACE_COUNTERS:
+                if counter in record:
+                    entry[counter] = entry.get(counter, 0) + record[counter]
+        for entry in stages.values():
+            for field in ("seconds", "max_seconds", "retry_wait", "quota_wait"):
+                if field in entry:
+                    entry[field] = round(entry[field], 3)
+        return stages
+
+    def report(self, **extra):
+        with self.lock:
+            records = list(self.records)
+        return {
+            "job_id": self.job_id,
+            "started_at": self.started_at,
+            "wall_seconds": round(time.perf_counter() - self.started, 3),
+            **extra,
+            "stages": self.summary(),
+            "records": records,
+        }
+
+    def write(self, path, **extra):
+        """レポートをJSONで保存してパスを返す"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, ensure_ascii=False, indent=2)
+        return path
+
+    def format_summary(self):
+        """ステータス表示用の要約（ステージごとに1行）"""
+        lines = [f"- 合計: {time.perf_counter() - self.started:.1f}秒"]
+        for name, entry in self.summary().items():
+            detail = [f"{entry['count']}件"]
+            if entry.get("requests"):
+                detail.append(f"API {entry['requests']}回")
+            if entry.get("retry_wait"):
+                detail.append(f"リトライ待機 {entry['retry_wait']:.1f}秒")
+            if entry.get("cache_hits"):
+                detail.append(f"キャッシュ {entry['cache_hits']}件")
+            if entry.get("bytes"):
+                detail.append(f"{entry['bytes'] / 1e6:.1f}MB")
+            lines.append(f"- {name}: {entry['seconds']:.1f}秒（{', '.join(detail)}）")
+        return "\n".join(lines)
+
+
+def trace_add(counter, value=1):
+    """このスレッドで実行中のステージ記録にカウンタを加算（ステージ外では何もしない）"""
+    record = getattr(_TRACE_LOCAL, "record", None)
+    if record is not None:
+        record[counter] = record.get(counter, 0) + value
+
+
 # ===========================
 # リトライ機構
 # ===========================
-def call_with_retry(func, *args, max_retries=3, initial_delay=60, **kwargs):
-    """レートリミット対応のリトライ機構"""
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRY_DELAY_PATTERN = re.compile(r"retry[_-]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+RETRYABLE_GRPC_STATUS = {"UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED"}
+# ステータスコードを持たない例外のフォールバック判定（"4290 tokens" などの部分一致を避ける）
+RATE_LIMIT_TEXT_PATTERN = re.compile(r"\b429\b|\bRESOURCE_EXHAUSTED\b")
+SERVER_ERROR_TEXT_PATTERN = re.compile(r"\b(?:50[0234]|UNAVAILABLE|INTERNAL|DEADLINE_EXCEEDED)\b")
+
+
+class RetryStats:
+    """リトライ回数と待機時間の集計（スレッドセーフ）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.retries = {}
+        self.wait_seconds = 0.0
+
+    def record(self, reason, delay):
+        with self.lock:
+            self.retries[reason] = self.retries.get(reason, 0) + 1
+            self.wait_seconds += delay
+
+    def snapshot(self):
+        with self.lock:
+            return {"retries": dict(self.retries), "wait_seconds": round(self.wait_seconds, 1)}
+
+
+RETRY_STATS = RetryStats()
+
+
+def classify_error(e):
+    """例外を (リトライ理由 or None, サーバー指定の待機秒数 or None) に分類"""
+    if isinstance(e, KeyRateLimited):
+        return "key_rotation", 0.0
+
+    error_str = str(e)
+    code = getattr(e, "code", None) or getattr(e, "status_code", None)
+    code = code if isinstance(code, int) else None
+    status = getattr(e, "status", None)
+    status = status if isinstance(status, str) else None
+
+    if isinstance(e, (TimeoutError, ConnectionError)) or "Timeout" in type(e).__name__:
+        reason = "timeout"
+    elif code is not None or status:
+        # サーバーが返したコード（genai.errors.APIErrorのcode/status）だけで判定
+        if code == 429 or status == "RESOURCE_EXHAUSTED":
+            reason = "rate_limit"
+        elif code in RETRYABLE_STATUS or status in RETRYABLE_GRPC_STATUS:
+            reason = "server_error"
+        else:
+            return None, None
+    elif RATE_LIMIT_TEXT_PATTERN.search(error_str):
+        reason = "rate_limit"
+    elif SERVER_ERROR_TEXT_PATTERN.search(error_str):
+        reason = "server_error"
+    else:
+        return None, None
+
+    # サーバーからの待機指示: RetryInfo.retryDelay（例: '34s'）または Retry-After ヘッダー
+    hint = None
+    match = RETRY_DELAY_PATTERN.search(error_str)
+    if match:
+        hint = float(match.group(1))
+    else:
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        retry_after = headers.get("retry-after") if hasattr(headers, "get") else None
+        if retry_after and str(retry_after).replace(".", "", 1).isdigit():
+            hint = float(retry_after)
+    return reason, hint
+
+
+def call_with_retry(func, *args, max_retries=None, **kwargs):
+    """レートリミット・一時的なサーバーエラー・タイムアウトに対するリトライ
+
+    サーバー指定の待機時間があればそれに従い、なければ指数バックオフ
+    （ジッター付き）で待機する。
+    """
+    max_retries = RETRY_MAX_ATTEMPTS if max_retries is None else max_retries
     for attempt in range(max_retries):
         try:
             return func(*args, **kwargs)
         except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                delay = initial_delay * (attempt + 1)  # 60s, 120s, 180s
-                print(f"[retry] レートリミット検出。{delay}秒待機後にリトライ ({attempt + 1}/{max_retries})")
-                time.sleep(delay)
+            reason, hint = classify_error(e)
+            if reason is None:
+                raise  # リトライ対象外のエラーはそのまま再送出
+            if reason == "key_rotation":
+                delay = 0.0  # 別キーで即リトライ（待機はApiKeyPool.acquireが担う）
+            elif hint is not None:
+                delay = min(hint, RETRY_MAX_DELAY) + random.uniform(0, 1)
             else:
-                raise  # 429以外のエラーはそのまま再送出
+                backoff = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+                delay = backoff / 2 + random.uniform(0, backoff / 2)
+            RETRY_STATS.record(reason, delay)
+            trace_add("retry_wait", delay)
+            print(f"[retry] {reason}検出。{delay:.1f}秒待機後にリトライ ({attempt + 1}/{max_retries})")
+            if delay:
+                time.sleep(delay)
     # 最終リトライ
     return func(*args, **kwargs)
 
 
+def call_gemini(key_pool, kind, request):
+    """キープールでキーを選び、共有クライアントでrequest(client)を実行（リトライ付き）"""
+    def _attempt():
+        api_key = key_pool.acquire(kind)
+        trace_add("requests")
+        try:
+            with CLIENT_POOL.lease(api_key) as client:
+                return request(client)
+        except Exception as e:
+            reason, hint = classify_error(e)
+            if reason == "rate_limit" and len(key_pool.keys) > 1:
+                key_pool.sideline(api_key, kind, hint or KEY_COOLDOWN_SECONDS)
+                raise KeyRateLimited(str(e)) from e
+            raise
+
+    return call_with_retry(_attempt)
+
+
+# ===========================
+# レートリミッター
+# ===========================
+class TokenBucket:
+    """トークンバケット方式のレートリミッター（RPM指定、スレッドセーフ）
+
+    burst=1 の場合はリクエスト間隔を 60/rpm 秒に平準化するため、
+    どの60秒窓でもrpmを超えない。
+    """
+
+    def __init__(self, rpm, burst=1):
+        self.rate = rpm / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """トークンを1つ取得できれば0を、できなければ補充までの秒数を返す（待機しない）"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """トークンを1つ取得（不足時は補充まで待機）し、待機秒数を返す"""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+
+# ===========================
+# APIキープール
+# ===========================
+class KeyRateLimited(Exception):
+    """複数キー運用時、レートリミットに達したキーを外して別キーで即リトライするための例外"""
+
+
+class ApiKeyPool:
+    """複数のGemini APIキーにリクエストを振り分けるスケジューラ
+
+    キー×用途（script/tts）ごとにトークンバケットと除外期限を持ち、
+    空きのあるキーをラウンドロビンで選ぶ。状態はプロセス全体で共有するため、
+    同じキーを使う並行ジョブの合計でもクォータを超えない。
+    """
+
+    _states = {}  # (api_key, kind) -> {"bucket", "sidelined_until", "requests", "rate_limited"}
+    _lock = threading.Lock()
+
+    def __init__(self, keys):
+        self.keys = list(dict.fromkeys(k for k in keys if k))
+        if not self.keys:
+            raise ValueError("APIキーがありません")
+        self.next_index = 0
+
+    @classmethod
+    def _state(cls, api_key, kind):
+        with cls._lock:
+            state = cls._states.get((api_key, kind))
+            if state is None:
+                rpm = SCRIPT_RPM if kind == "script" else TTS_RPM
+                state = {"bucket": TokenBucket(rpm), "sidelined_until": 0.0, "requests": 0, "rate_limited": 0}
+                cls._states[(api_key, kind)] = state
+            return state
+
+    def acquire(self, kind):
+        """RPMに空きがあり除外中でないキーを1つ選ぶ（全キー不可なら最短の空きまで待機）"""
+        while True:
+            with self._lock:
+                start = self.next_index
+                self.next_index = (self.next_index + 1) % len(self.keys)
+
+            wait = None
+            for i in range(len(self.keys)):
+                api_key = self.keys[(start + i) % len(self.keys)]
+                state = self._state(api_key, kind)
+                key_wait = state["sidelined_until"] - time.monotonic()
+                if key_wait <= 0:
+                    key_wait = state["bucket"].try_acquire()
+                    if key_wait == 0.0:
+                        with self._lock:  # 並行ジョブと共有するカウンタ
+                            state["requests"] += 1
+                        return api_key
+                wait = key_wait if wait is None else min(wait, key_wait)
+            time.sleep(min(wait, 1.0))
+            trace_add("quota_wait", min(wait, 1.0))
+
+    def sideline(self, api_key, kind, seconds):
+        """クォータ枯渇したキーを一定時間除外"""
+        state = self._state(api_key, kind)
+        with self._lock:
+            state["sidelined_until"] = max(state["sidelined_until"], time.monotonic() + seconds)
+            state["rate_limited"] += 1
+        print(f"[keys] キー ...{api_key[-4:]} ({kind}) を{seconds:.0f}秒間除外")
+
+    def stats(self):
+        """キーごとのリクエスト数・レートリミット回数（キーは末尾4文字のみ）"""
+        with self._lock:  # 他ジョブのスレッドが_stateで追加・更新し得る
+            return {
+                f"...{api_key[-4:]}:{kind}": {"requests": state["requests"], "rate_limited": state["rate_limited"]}
+                for (api_key, kind), state in self._states.items() if api_key in self.keys
+            }
+
+
+def parse_api_keys(value):
+    """カンマ・改行・空白区切りの文字列からAPIキーのリストを作成"""
+    return [k for k in re.split(r"[\s,;]+", value or "") if k]
+
+
+def load_env_api_keys():
+    """GEMINI_API_KEY（複数可）とGEMINI_API_KEY_FILE（1行1キー）からキーを読み込む"""
+    keys = parse_api_keys(os.environ.get("GEMINI_API_KEY", ""))
+    key_file = os.environ.get("GEMINI_API_KEY_FILE")
+    if key_file and os.path.exists(key_file):
+        with open(key_file, encoding="utf-8") as f:
+            keys += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return list(dict.fromkeys(keys))
+
+
 # ===========================
 # 設定
 # ===========================
 PAGES_PER_CHUNK = 5
+CHUNK_MAX_BYTES = 15 * 1024 * 1024  # 1チャンクのPDFサイズ上限（インライン送信の20MB制限内に収める。Noneで無効）
 AUDIO_SPEED = 1.2
 SILENCE_BEFORE = 1000
 SILENCE_AFTER = 500
+AUDIO_SPEED_MODE = "resample"  # "resample": 再生速度変更（音程も上がる） / "wsola": 音程維持タイムストレッチ
+AUDIO_NORMALIZE_DBFS = None    # 例: -20.0 でRMS音量を揃える（Noneで無効）
+TTS_SAMPLE_RATE = 24000        # Gemini TTSの出力PCM（16bit mono）
 OUTPUT_FPS = 24
 OUTPUT_RESOLUTION = (1280, 720)  # HD画質（高速化）
+VIDEO_PRESET = "veryfast"      # libx264プリセット（静止画なので速度優先）
+VIDEO_GOP_SECONDS = 10         # キーフレーム間隔（静止画なので長めでOK）
+AUDIO_SAMPLE_RATE = 44100      # セグメント間で統一（stream copy結合のため）
+AUDIO_BITRATE = "192k"
+FFMPEG_BIN = "ffmpeg"
+RENDER_MODE = "segments"       # "segments": ページ動画→結合 / "single_pass": 全体を1回でエンコード
+RETRY_MAX_ATTEMPTS = 6         # リトライ回数上限
+RETRY_BASE_DELAY = 2.0         # 指数バックオフの初期待機秒数
+RETRY_MAX_DELAY = 120.0        # 1回あたりの最大待機秒数
+TTS_RPM = 10                   # TTSモデルのリクエスト上限（/分）
+TTS_MAX_WORKERS = 4            # TTS同時実行数
+TTS_BATCH_PAGES = 1            # 1リクエストにまとめるページ数（1で無効）
+TTS_PAGE_BREAK = "＜ページ区切り＞"
+TTS_PAGE_BREAK_MIN_SILENCE = 1.5  # ページ区切りとみなす無音の最短秒数
+SCRIPT_RPM = 10                # 台本生成モデルのリクエスト上限（/分）
+SCRIPT_MAX_WORKERS = 4         # 台本生成の同時実行数
+SCRIPT_INPUT_MODE = "adaptive"  # "pdf": チャンクPDFを送信 / "adaptive": 抽出テキスト＋図表の多いページのみ画像
+SCRIPT_IMAGE_DPI = 96          # adaptive時に添付するページ画像の解像度
+SCRIPT_FIGURE_AREA_RATIO = 0.15  # 画像がページ面積のこの割合以上なら図表ページ
+SCRIPT_FIGURE_MIN_DRAWINGS = 30  # ベクター描画がこの数以上なら図表ページ（グラフ・図解）
+SCRIPT_MIN_TEXT_CHARS = 40     # 抽出テキストがこれ未満なら画像を添付（スキャン・図のみのページ）
+SCRIPT_MAX_FIGURE_PAGES = 0.5  # 図表ページがチャンクのこの割合を超えたらPDFをそのまま送信
+KEY_COOLDOWN_SECONDS = 60      # レートリミットに達したキーの既定の除外秒数
+UI_CONCURRENCY_LIMIT = 2       # Gradioで同時に処理するジョブ数
+UI_MAX_QUEUE_SIZE = 20         # Gradioの待ち行列の上限
+ENCODE_CONCURRENCY = max(1, (os.cpu_count() or 2) // 2)  # 全ジョブ共通のffmpegエンコード同時実行数
+ENCODE_THREADS = max(1, (os.cpu_count() or 2) // ENCODE_CONCURRENCY)  # セグメント用ffmpeg1本あたりのスレッド数（過剰スレッド防止）
+ENCODE_WORKERS = ENCODE_CONCURRENCY  # 1ジョブ内でセグメントを並列エンコードするワーカー数
+BATCH_CONCURRENCY = 2          # バッチモードで同時処理するPDF数
+PIPELINE_QUEUE_SIZE = 4        # TTS完了→エンコード待ちのページ数上限（メモリ上限）
+INCREMENTAL_RENDER = True      # 改訂版PDFでは前回ジョブから未変更ページの台本・音声・動画を再利用
+PAGE_FINGERPRINT_DPI = 72      # ページ差分検出用の描画解像度
+PROGRESSIVE_DELIVERY = True    # 完成したページから順にプレビュー配信・部分アップロード（segmentsモードのみ）
+PART_UPLOAD_INTERVAL = 30      # 部分アップロードの最短間隔（秒、HFへのコミット数を抑える）
+JOBS_MAX_BYTES = 10 * 1024 ** 3  # ジョブディレクトリ全体の上限（超過時は古いジョブから削除）
+OUTPUTS_KEEP_SECONDS = 24 * 3600  # 完成動画・レポートの最短保持時間（上限超過時はこれより古いものから削除）
+
+SCRIPT_MODEL = "gemini-3-flash-preview"
+TTS_MODEL = "gemini-2.5-flash-preview-tts"
+GENAI_CLIENTS_PER_KEY = 2      # APIキーあたりのクライアント数
+GENAI_MAX_IN_FLIGHT = 4        # クライアントあたりの同時リクエスト数
+CACHE_ENABLED = True
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(tempfile.gettempdir(), "pdf_movie_cache"))
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # 2GB
+JOBS_DIR = os.environ.get("JOBS_DIR", os.path.join(tempfile.gettempdir(), "pdf_movie_jobs"))
+
 
 # 環境変数
-ENV_GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+ENV_GEMINI_API_KEYS = load_env_api_keys()
 ENV_HF_TOKEN = os.environ.get("HF_TOKEN", "")
 ENV_HF_REPO_ID = os.environ.get("HF_REPO_ID", "leave-everything/PDFtoMOVIEwithAUDIO")
 
@@ -145,48 +530,268 @@ PROGRAM_STYLES = {
 }
 
 
-def split_pdf(pdf_path, pages_per_chunk=5):
-    """PDFを指定ページ数ごとに分割"""
-    print(f"[split_pdf] PDF分割開始")
-    doc = fitz.open(pdf_path)
-    total_pages = len(doc)
-    print(f"[split_pdf] 総ページ数: {total_pages}, {pages_per_chunk}ページごとに分割")
-    chunks = []
+# ===========================
+# APIクライアントプール
+# ===========================
+class GenaiClientPool:
+    """APIキーごとにgenai.Clientを使い回すプール
+
+    呼び出しごとのクライアント生成（TLSハンドシェイク・接続確立）を避け、
+    クライアントあたりの同時リクエスト数を制限して接続数を予測可能にする。
+    """
+
+    def __init__(self, clients_per_key, max_in_flight):
+        self.clients_per_key = clients_per_key
+        self.max_in_flight = max_in_flight
+        self.entries = {}  # api_key -> [[client, in_flight], ...]
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def lease(self, api_key):
+        """最も空いているクライアントを貸し出す（全て上限なら空くまで待機）"""
+        with self.cond:
+            entries = self.entries.get(api_key)
+            if entries is None:
+                entries = [[genai.Client(api_key=api_key), 0] for _ in range(self.clients_per_key)]
+                self.entries[api_key] = entries
+            while True:
+                entry = min(entries, key=lambda e: e[1])
+                if entry[1] < self.max_in_flight:
+                    break
+                self.cond.wait()
+            entry[1] += 1
+        try:
+            yield entry[0]
+        finally:
+            with self.cond:
+                entry[1] -= 1
+                self.cond.notify()
+
+
+# ===========================
+# キャッシュ
+# ===========================
+class ArtifactCache:
+    """コンテンツアドレス方式のディスクキャッシュ（サイズ上限付きLRU）
+
+    キーは入力一式のSHA-256。参照時にmtimeを更新し、上限超過時は
+    最も古く参照されたファイルから削除する。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = sum(p.stat().st_size for p in self.cache_dir.rglob("*") if p.is_file())
+
+    @staticmethod
+    def make_key(*parts):
+        """文字列/バイト列の組からキャッシュキーを生成"""
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, namespace, key):
+        return self.cache_dir / namespace / key[:2] / key
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # LRU用に参照時刻を更新
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            trace_add("cache_misses")
+            return None
+        with self.lock:
+            self.hits += 1
+        trace_add("cache_hits")
+        return data
+
+    def put(self, namespace, key, data):
+        path = self._path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """上限の9割まで古いものから削除（lock保持中に呼ぶ）"""
+        files = sorted(
+            (p for p in self.cache_dir.rglob("*") if p.is_file()),
+            key=lambda p: p.stat().st_mtime
+        )
+        self.size = sum(p.stat().st_size for p in files)
+        target = self.max_bytes * 0.9
+        for path in files:
+            if self.size <= target:
+                break
+            size = path.stat().st_size
+            path.unlink(missing_ok=True)
+            self.size -= size
+        print(f"[cache] LRU削除実行: 現在 {self.size / 1e6:.1f}MB")
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size}
 
-    for start in range(0, total_pages, pages_per_chunk):
-        end = min(start + pages_per_chunk, total_pages)
-        chunk_doc = fitz.open()
 
-        for page_num in range(start, end):
-            chunk_doc.insert_pdf(doc, from_page=page_num, to_page=page_num)
+ARTIFACT_CACHE = ArtifactCache(CACHE_DIR, CACHE_MAX_BYTES) if CACHE_ENABLED else None
+CLIENT_POOL = GenaiClientPool(GENAI_CLIENTS_PER_KEY, GENAI_MAX_IN_FLIGHT)
+ENCODE_SLOTS = threading.BoundedSemaphore(ENCODE_CONCURRENCY)
 
-        chunk_path = tempfile.mktemp(suffix='.pdf')
-        chunk_doc.save(chunk_path)
+
+def pdf_chunk_bytes(doc, start, end):
+    """start〜end-1ページ（0始まり）を単独のPDFバイト列にする
+
+    未使用オブジェクトの削除・ストリーム圧縮・コンテンツの整理（未使用リソースの除去）を行い、
+    no_new_idで同一内容なら同一バイト列にする（キャッシュキー安定化）。
+    """
+    chunk_doc = fitz.open()
+    try:
+        chunk_doc.insert_pdf(doc, from_page=start, to_page=end - 1, links=False)
+        return chunk_doc.tobytes(garbage=3, deflate=True, clean=True, no_new_id=True)
+    finally:
         chunk_doc.close()
 
-        page_numbers = list(range(start + 1, end + 1))
-        chunks.append((chunk_path, page_numbers))
 
-    doc.close()
-    print(f"[split_pdf] 分割完了: {len(chunks)}チャンク作成")
-    return chunks
+def split_pdf(doc, pages_per_chunk=5, max_bytes=None, skip=None):
+    """PDF（fitzドキュメント）をチャンクに分割し、ページ番号リストのリストを返す
 
+    1チャンクは最大pages_per_chunkページ。max_bytesを指定すると、
+    それを超えないところでチャンクを区切る（画像の多いPDF向け）。
+    元ファイルが上限以下なら部分PDFも上限を超えないため、書き出しての計測は省く。
+    skip(ページ番号リスト)が真のチャンク（台本が揃っている等）も計測しない。
+    チャンクのバイト列は保持せず、必要になった時点でpdf_chunk_bytesで作る。
+    """
+    print(f"[split_pdf] PDF分割開始")
+    total_pages = len(doc)
+    print(f"[split_pdf] 総ページ数: {total_pages}, 最大{pages_per_chunk}ページ/{max_bytes or '-'}バイトごとに分割")
+    if max_bytes and doc.name and os.path.exists(doc.name) and os.path.getsize(doc.name) <= max_bytes:
+        max_bytes = None
+    chunks = []
+    measured = 0
 
-def pdf_to_images(pdf_path, dpi=150):
-    """PDFを画像に変換"""
-    print(f"[pdf_to_images] 画像変換開始")
-    images = convert_from_path(pdf_path, dpi=dpi)
-    print(f"[pdf_to_images] 変換完了: {len(images)}ページ")
-    return images
+    start = 0
+    while start < total_pages:
+        end = min(start + pages_per_chunk, total_pages)
+        if max_bytes and not (skip and skip(list(range(start + 1, end + 1)))):
+            # 全ページ分を1回書き出し、上限超過時だけ末尾から縮める
+            size = len(pdf_chunk_bytes(doc, start, end))
+            measured += 1
+            while size > max_bytes and end - start > 1:
+                end -= 1
+                size = len(pdf_chunk_bytes(doc, start, end))
+                measured += 1
+            if size > max_bytes:
+                print(f"[split_pdf] 警告: ページ{start + 1}単独で上限超過 ({size / 1e6:.1f}MB)")
+
+        chunks.append(list(range(start + 1, end + 1)))
+        start = end
+
+    print(f"[split_pdf] 分割完了: {len(chunks)}チャンク作成 (サイズ計測 {measured}回)")
+    return chunks
 
 
-def generate_narration_script(pdf_chunk_path, page_numbers, program_style, api_key, chunk_index, total_chunks, total_pages):
-    """Gemini APIでナレーション台本を生成（構造化出力）"""
+def page_has_figures(page, text):
+    """画像・グラフなど、テキストだけでは内容が伝わらないページか（ローカル判定）"""
+    if len(text.strip()) < SCRIPT_MIN_TEXT_CHARS:
+        return True
+    page_area = page.rect.get_area()
+    image_area = sum(fitz.Rect(info["bbox"]).intersect(page.rect).get_area() for info in page.get_image_info())
+    if image_area >= page_area * SCRIPT_FIGURE_AREA_RATIO:
+        return True
+    # ページ全体を覆う背景の塗りは図表とみなさない
+    drawings = [d for d in page.get_drawings() if d["rect"].get_area() < page_area * 0.8]
+    return len(drawings) >= SCRIPT_FIGURE_MIN_DRAWINGS
+
+
+def build_script_input(doc, page_numbers):
+    """台本生成に送る入力を [(MIMEタイプ, バイト列)] で返す
+
+    adaptiveモードではページごとの抽出テキストを送り、図表の多いページだけ
+    低解像度の画像を添付する（PDFは全ページが画像としてもトークン化されるため）。
+    図表ページがSCRIPT_MAX_FIGURE_PAGESを超えるチャンクはPDFをそのまま送る。
+    チャンクPDFはその場合にだけ書き出す。
+    """
+    if SCRIPT_INPUT_MODE != "adaptive":
+        return [("application/pdf", pdf_chunk_bytes(doc, page_numbers[0] - 1, page_numbers[-1]))]
+
+    parts = []
+    figure_pages = 0
+    for page_num in page_numbers:
+        page = doc[page_num - 1]
+        text = page.get_text("text")
+        parts.append(("text/plain", f"【ページ{page_num}】\n{text.strip()}\n".encode("utf-8")))
+        if page_has_figures(page, text):
+            figure_pages += 1
+            pix = page.get_pixmap(dpi=SCRIPT_IMAGE_DPI, alpha=False)
+            png, jpeg = pix.tobytes("png"), pix.tobytes("jpg", jpg_quality=75)
+            parts.append(("text/plain", f"（ページ{page_num}の画像）".encode("utf-8")))
+            parts.append(("image/png", png) if len(png) <= len(jpeg) else ("image/jpeg", jpeg))
+
+    if figure_pages > len(page_numbers) * SCRIPT_MAX_FIGURE_PAGES:
+        return [("application/pdf", pdf_chunk_bytes(doc, page_numbers[0] - 1, page_numbers[-1]))]
+    print(f"[script_input] ページ {page_numbers}: テキスト入力（画像 {figure_pages}枚）")
+    return parts
+
+
+class PageRasterizer:
+    """必要になったページだけを出力解像度で描画する遅延ラスタライザ
+
+    split_pdfと同じfitzドキュメントを共有し、全ページの画像を保持しない。
+    """
+
+    def __init__(self, doc, target_size=OUTPUT_RESOLUTION):
+        self.doc = doc
+        self.target_size = target_size
+        self.lock = threading.Lock()  # fitzドキュメントはスレッドセーフではない
+
+    def render_frame(self, page_num):
+        """1始まりのページ番号をレターボックス済みの出力サイズで直接描画
+
+        戻り値は幅×高さ×3バイトの生RGB（エンコーダへそのまま渡せる）。
+        """
+        target_w, target_h = self.target_size
+        with self.lock:
+            page = self.doc[page_num - 1]
+            zoom = min(target_w / page.rect.width, target_h / page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+
+        # 丸めで1px超えることがあるため出力サイズに切り詰める
+        w, h = min(pix.width, target_w), min(pix.height, target_h)
+        canvas = np.zeros((target_h, target_w, 3), dtype=np.uint8)
+        x, y = (target_w - w) // 2, (target_h - h) // 2
+        canvas[y:y + h, x:x + w] = pixels[:h, :w * 3].reshape(h, w, 3)
+        return canvas.tobytes()
+
+    def fingerprint(self, page_num, dpi=PAGE_FINGERPRINT_DPI):
+        """ページの指紋（抽出テキスト＋低解像度の描画結果のSHA-256）"""
+        with self.lock:
+            page = self.doc[page_num - 1]
+            text = page.get_text("text")
+            pix = page.get_pixmap(dpi=dpi, alpha=False)
+        return ArtifactCache.make_key(text, f"{pix.width}x{pix.height}", pix.samples)
+
+
+def generate_narration_script(script_input, page_numbers, program_style, key_pool, chunk_index, total_chunks, total_pages):
+    """Gemini APIでナレーション台本を生成（構造化出力）
+
+    script_input: build_script_inputが返す [(MIMEタイプ, バイト列)]（チャンクPDFまたはテキスト＋画像）
+    戻り値: (ページ番号→台本の辞書, 定型のフォールバック台本で埋めたページ番号のset)
+    """
     print(f"[generate_script] 台本生成開始: ページ {page_numbers} (チャンク {chunk_index}/{total_chunks})")
-    client = genai.Client(api_key=api_key)
-
-    with open(pdf_chunk_path, 'rb') as f:
-        pdf_data = f.read()
 
     speaker_info = program_style["speaker_config"]
     speaker_names = [info["name"] for info in speaker_info.values()]
@@ -214,6 +819,11 @@ def generate_narration_script(pdf_chunk_path, page_numbers, program_style, api_k
 各ページにつき2〜4往復の対話を含めてください。
 """
 
+    if script_input[0][0] == "application/pdf":
+        input_instruction = "添付されたPDFの各ページを注意深く読み取ってください"
+    else:
+        input_instruction = "添付された各ページの抽出テキスト（図表の多いページは画像も添付）を注意深く読み取ってください"
+
     # チャンク位置に応じた構成指示
     if total_chunks == 1:
         position_instruction = "これは単独の資料です。適切な導入と締めくくりを含めてください。"
@@ -243,7 +853,7 @@ def generate_narration_script(pdf_chunk_path, page_numbers, program_style, api_k
 {position_instruction}
 
 【重要な指示】
-1. 添付されたPDFの各ページを注意深く読み取ってください
+1. {input_instruction}
 2. テキスト、図表、画像、グラフなど全ての要素を認識してください
 3. 各ページの内容を正確に理解した上で、ナレーション台本を作成してください
 4. 必ず指定されたすべてのページ（{len(page_numbers)}ページ分）の台本を生成してください
@@ -264,22 +874,36 @@ def generate_narration_script(pdf_chunk_path, page_numbers, program_style, api_k
 PDFの内容を詳細に分析し、視聴者にとって価値のあるナレーション台本を作成してください。
 """
 
-    # 構造化出力でAPI呼び出し
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=[
-            types.Content(
-                parts=[
-                    types.Part.from_bytes(data=pdf_data, mime_type="application/pdf"),
-                    types.Part.from_text(text=prompt)
-                ]
+    # キャッシュ参照（PDFバイト列・プロンプト・モデル・番組スタイルが同一なら再利用）
+    cache_key = ArtifactCache.make_key(
+        *(part for mime_type, data in script_input for part in (mime_type, data)), prompt, SCRIPT_MODEL, json.dumps(program_style, ensure_ascii=False, sort_keys=True)
+    )
+    if ARTIFACT_CACHE:
+        cached = ARTIFACT_CACHE.get("scripts", cache_key)
+        if cached is not None:
+            print(f"[generate_script] キャッシュヒット: ページ {page_numbers}")
+            return {int(k): v for k, v in json.loads(cached).items()}, set()
+
+    # 構造化出力でAPI呼び出し（TTSと同じリトライ・レート制御）
+    def _call_script(client):
+        return client.models.generate_content(
+            model=SCRIPT_MODEL,
+            contents=[
+                types.Content(
+                    parts=[
+                        types.Part.from_text(text=data.decode("utf-8")) if mime_type == "text/plain"
+                        else types.Part.from_bytes(data=data, mime_type=mime_type)
+                        for mime_type, data in script_input
+                    ] + [types.Part.from_text(text=prompt)]
+                )
+            ],
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=response_schema
             )
-        ],
-        config=types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=response_schema
         )
-    )
+
+    response = call_gemini(key_pool, "script", _call_script)
 
     # 構造化されたレスポンスをパース
     try:
@@ -303,26 +927,32 @@ PDFの内容を詳細に分析し、視聴者にとって価値のあるナレ
                 dialogue = page_info.get("dialogue", [])
                 result[page_num] = [{"speaker": d.get("speaker", speaker_names[0]), "text": d.get("text", "")} for d in dialogue]
 
+    # 全ページ揃った結果のみキャッシュ（フォールバックを固定化しない）
+    if ARTIFACT_CACHE and all(p in result for p in page_numbers):
+        ARTIFACT_CACHE.put("scripts", cache_key, json.dumps(result, ensure_ascii=False).encode("utf-8"))
+
     # 欠落ページのフォールバック
-    for page_num in page_numbers:
-        if page_num not in result:
-            print(f"[generate_script] 警告: ページ{page_num}の台本が欠落、フォールバック使用")
-            if is_single_speaker:
-                result[page_num] = f"ページ{page_num}の内容について説明します。"
-            else:
-                result[page_num] = [
-                    {"speaker": speaker_names[0], "text": f"ページ{page_num}について見ていきましょう。"},
-                    {"speaker": speaker_names[1], "text": "はい、お願いします。"}
-                ]
+    fallback_pages = {page_num for page_num in page_numbers if page_num not in result}
+    for page_num in sorted(fallback_pages):
+        print(f"[generate_script] 警告: ページ{page_num}の台本が欠落、フォールバック使用")
+        if is_single_speaker:
+            result[page_num] = f"ページ{page_num}の内容について説明します。"
+        else:
+            result[page_num] = [
+                {"speaker": speaker_names[0], "text": f"ページ{page_num}について見ていきましょう。"},
+                {"speaker": speaker_names[1], "text": "はい、お願いします。"}
+            ]
 
     print(f"[generate_script] 台本生成完了: {len(result)}ページ分")
-    return result
+    return result, fallback_pages
+
+
+PAGE_BREAK_INSTRUCTION = f"- 「{TTS_PAGE_BREAK}」の行は読み上げず、その位置で3秒間完全に無音の間を空けてください\n"
 
 
-def text_to_speech_single(text, voice_name, style_prompt, api_key):
+def text_to_speech_single(text, voice_name, style_prompt, key_pool, page_break=False):
     """1人用TTS（レートリミット対応）"""
     print(f"[TTS] 音声生成開始 (1人モード, voice={voice_name})")
-    client = genai.Client(api_key=api_key)
 
     full_prompt = f"""{style_prompt}
 
@@ -330,13 +960,20 @@ def text_to_speech_single(text, voice_name, style_prompt, api_key):
 - やや早口でテンポよく読み上げてください
 - 日本語の発音は正確に、滑舌よくはっきりと発声してください
 - 聞き取りやすさを維持しながらスピード感のある読み上げをしてください
-
+{PAGE_BREAK_INSTRUCTION if page_break else ""}
 以下のテキストを読み上げてください:
 {text}"""
 
-    def _call_tts():
+    cache_key = ArtifactCache.make_key(full_prompt, voice_name, TTS_MODEL)
+    if ARTIFACT_CACHE:
+        cached = ARTIFACT_CACHE.get("tts", cache_key)
+        if cached is not None:
+            print(f"[TTS] キャッシュヒット (1人モード)")
+            return cached
+
+    def _call_tts(client):
         return client.models.generate_content(
-            model="gemini-2.5-flash-preview-tts",
+            model=TTS_MODEL,
             contents=full_prompt,
             config=types.GenerateContentConfig(
                 response_modalities=["AUDIO"],
@@ -350,19 +987,24 @@ def text_to_speech_single(text, voice_name, style_prompt, api_key):
             )
         )
 
-    response = call_with_retry(_call_tts)
+    response = call_gemini(key_pool, "tts", _call_tts)
+    pcm_data = response.candidates[0].content.parts[0].inline_data.data
+    if ARTIFACT_CACHE:
+        ARTIFACT_CACHE.put("tts", cache_key, pcm_data)
     print(f"[TTS] 音声生成完了 (1人モード)")
-    return response.candidates[0].content.parts[0].inline_data.data
+    return pcm_data
 
 
-def text_to_speech_multi(dialogue, speaker_config, style_prompts, api_key):
+def text_to_speech_multi(dialogue, speaker_config, style_prompts, key_pool, page_break=False):
     """2人用マルチスピーカーTTS（レートリミット対応）"""
     print(f"[TTS] 音声生成開始 (2人モード, {len(dialogue)}セリフ)")
-    client = genai.Client(api_key=api_key)
 
     conversation_text = ""
     for line in dialogue:
-        conversation_text += f"{line['speaker']}: {line['text']}\n"
+        if line["speaker"] is None:
+            conversation_text += f"{line['text']}\n"  # ページ区切り行
+        else:
+            conversation_text += f"{line['speaker']}: {line['text']}\n"
 
     host_info = speaker_config["host"]
     guest_info = speaker_config["guest"]
@@ -377,14 +1019,23 @@ def text_to_speech_multi(dialogue, speaker_config, style_prompts, api_key):
 - やや早口でテンポよく読み上げてください
 - 日本語の発音は正確に、滑舌よくはっきりと発声してください
 - 掛け合いのテンポ感を大切に、スピード感のある会話にしてください
-
+{PAGE_BREAK_INSTRUCTION if page_break else ""}
 会話:
 {conversation_text}
 """
 
-    def _call_tts():
+    cache_key = ArtifactCache.make_key(
+        style_instruction, host_info["name"], host_info["voice"], guest_info["name"], guest_info["voice"], TTS_MODEL
+    )
+    if ARTIFACT_CACHE:
+        cached = ARTIFACT_CACHE.get("tts", cache_key)
+        if cached is not None:
+            print(f"[TTS] キャッシュヒット (2人モード)")
+            return cached
+
+    def _call_tts(client):
         return client.models.generate_content(
-            model="gemini-2.5-flash-preview-tts",
+            model=TTS_MODEL,
             contents=style_instruction,
             config=types.GenerateContentConfig(
                 response_modalities=["AUDIO"],
@@ -413,12 +1064,123 @@ def text_to_speech_multi(dialogue, speaker_config, style_prompts, api_key):
             )
         )
 
-    response = call_with_retry(_call_tts)
+    response = call_gemini(key_pool, "tts", _call_tts)
+    pcm_data = response.candidates[0].content.parts[0].inline_data.data
+    if ARTIFACT_CACHE:
+        ARTIFACT_CACHE.put("tts", cache_key, pcm_data)
     print(f"[TTS] 音声生成完了 (2人モード)")
-    return response.candidates[0].content.parts[0].inline_data.data
+    return pcm_data
+
+
+def page_tts_input(page_num, script, program_style):
+    """台本をTTS入力に整形（1人: ナレーション文字列 / 2人: 対話リスト）"""
+    if program_style["speakers"] == 1:
+        return script if isinstance(script, str) else f"ページ{page_num}です。"
+    return script if isinstance(script, list) else [
+        {"speaker": program_style["speaker_config"]["host"]["name"],
+         "text": f"ページ{page_num}について見ていきましょう。"}
+    ]
 
 
-def save_pcm_to_wav(pcm_data, output_path, sample_rate=24000, channels=1, sample_width=2):
+def synthesize_text(tts_input, program_style, key_pool, page_break=False):
+    """整形済みTTS入力を番組スタイルの話者設定で音声化"""
+    if program_style["speakers"] == 1:
+        host_config = program_style["speaker_config"]["host"]
+
+        return text_to_speech_single(
+            tts_input,
+            host_config["voice"],
+            program_style.get("tts_style", "自然に読み上げてください。"),
+            key_pool,
+            page_break=page_break
+        )
+
+    style_prompts = {
+        "host": program_style.get("tts_style_host", "自然に話してください。"),
+        "guest": program_style.get("tts_style_guest", "自然に話してください。")
+    }
+
+    return text_to_speech_multi(
+        tts_input,
+        program_style["speaker_config"],
+        style_prompts,
+        key_pool,
+        page_break=page_break
+    )
+
+
+def synthesize_page(page_num, script, program_style, key_pool):
+    """1ページ分の台本を音声化（スレッドプールから呼ばれる）"""
+    pcm_data = synthesize_text(page_tts_input(page_num, script, program_style), program_style, key_pool)
+    return page_num, pcm_data
+
+
+def split_pcm_on_silences(pcm_data, n_parts, sample_rate=TTS_SAMPLE_RATE):
+    """ページ区切りの長い無音でPCMをn_parts個に分割（検出できなければNone）
+
+    10ms単位のRMSで無音区間を求め、TTS_PAGE_BREAK_MIN_SILENCE秒以上の
+    無音のうち長い順にn_parts-1個を区切りとして採用する。
+    """
+    samples = np.frombuffer(pcm_data, dtype=np.int16).astype(np.float32)
+    hop = sample_rate // 100
+    n_frames = len(samples) // hop
+    if n_frames == 0:
+        return None
+
+    rms = np.sqrt(np.mean(samples[:n_frames * hop].reshape(n_frames, hop) ** 2, axis=1))
+    silent = rms < max(np.percentile(rms, 95) * 0.03, 30.0)
+
+    # 無音区間の[開始, 終了)フレームを抽出
+    edges = np.diff(np.concatenate([[0], silent.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    min_frames = int(TTS_PAGE_BREAK_MIN_SILENCE * 100)
+    runs = [(s, e) for s, e in zip(starts, ends) if e - s >= min_frames and s > 0 and e < n_frames]
+    if len(runs) < n_parts - 1:
+        return None
+
+    breaks = sorted(sorted(runs, key=lambda r: r[1] - r[0], reverse=True)[:n_parts - 1])
+    bounds = [0] + [b for run in breaks for b in run] + [n_frames]
+    parts = []
+    for start, end in zip(bounds[::2], bounds[1::2]):
+        if end - start < 30:  # 0.3秒未満は分割失敗とみなす
+            return None
+        end_byte = end * hop * 2 if end < n_frames else len(pcm_data)
+        parts.append(pcm_data[start * hop * 2:end_byte])
+    return parts
+
+
+def synthesize_pages(page_scripts, program_style, key_pool):
+    """複数ページを1リクエストで音声化し、無音検出でページごとに切り分け
+
+    page_scripts: [(ページ番号, 台本)]。分割に失敗した場合はページ単位で再生成。
+    戻り値: {ページ番号: PCM}
+    """
+    if len(page_scripts) == 1:
+        page_num, pcm_data = synthesize_page(*page_scripts[0], program_style, key_pool)
+        return {page_num: pcm_data}
+
+    page_nums = [p for p, _ in page_scripts]
+    inputs = [page_tts_input(p, script, program_style) for p, script in page_scripts]
+    if program_style["speakers"] == 1:
+        batch_input = f"\n{TTS_PAGE_BREAK}\n".join(inputs)
+    else:
+        batch_input = []
+        for dialogue in inputs:
+            if batch_input:
+                batch_input.append({"speaker": None, "text": TTS_PAGE_BREAK})
+            batch_input.extend(dialogue)
+
+    print(f"[TTS] バッチ音声生成: ページ {page_nums}")
+    pcm_data = synthesize_text(batch_input, program_style, key_pool, page_break=True)
+    parts = split_pcm_on_silences(pcm_data, len(page_scripts))
+    if parts is None:
+        print(f"[TTS] バッチ分割失敗、ページ単位で再生成: {page_nums}")
+        return dict(synthesize_page(p, script, program_style, key_pool) for p, script in page_scripts)
+
+    return dict(zip(page_nums, parts))
+
+
+def save_pcm_to_wav(pcm_data, output_path, sample_rate=TTS_SAMPLE_RATE, channels=1, sample_width=2):
     """PCMをWAVに保存"""
     with wave.open(output_path, "wb") as wf:
         wf.setnchannels(channels)
@@ -427,78 +1189,134 @@ def save_pcm_to_wav(pcm_data, output_path, sample_rate=24000, channels=1, sample
         wf.writeframes(pcm_data)
 
 
-def process_audio(wav_path, speed=1.2, silence_before_ms=1000, silence_after_ms=500):
-    """音声処理: 速度変換、無音追加"""
-    print(f"[process_audio] 音声処理開始 (速度={speed}x)")
-    audio = AudioSegment.from_wav(wav_path)
+def time_stretch_wsola(samples, speed, sample_rate=TTS_SAMPLE_RATE):
+    """WSOLAによる音程維持タイムストレッチ
 
-    new_sample_rate = int(audio.frame_rate * speed)
-    speed_audio = audio._spawn(audio.raw_data, overrides={
-        "frame_rate": new_sample_rate
-    }).set_frame_rate(audio.frame_rate)
+    40msのHann窓を50%重ねで合成し、各フレームの読み出し位置を±10msの
+    範囲で直前フレームの自然な続きと最も相関が高い位置に合わせる。
+    """
+    frame = int(sample_rate * 0.040) // 2 * 2
+    hop_out = frame // 2
+    hop_in = hop_out * speed
+    tolerance = int(sample_rate * 0.010)
+    window = np.hanning(frame + 1)[:-1].astype(np.float32)  # 50%重ねで和が1になる周期Hann窓
 
-    silence_before = AudioSegment.silent(duration=silence_before_ms)
-    silence_after = AudioSegment.silent(duration=silence_after_ms)
+    n_frames = int(len(samples) / hop_in) + 1
+    padded = np.pad(samples.astype(np.float32), (tolerance, 2 * frame + 2 * tolerance))
+    output = np.zeros(n_frames * hop_out + frame, dtype=np.float32)
 
-    final_audio = silence_before + speed_audio + silence_after
+    pos = 0
+    for k in range(1, n_frames):
+        # 直前フレームの自然な続き（テンプレート）と、公称位置周辺の候補区間を相互相関
+        natural = pos + hop_out
+        template = padded[natural + tolerance:natural + tolerance + frame]
+        nominal = int(k * hop_in)
+        region = padded[nominal:nominal + frame + 2 * tolerance]
+        offset = int(np.argmax(np.correlate(region, template, 'valid')))
 
-    output_path = tempfile.mktemp(suffix='.wav')
-    final_audio.export(output_path, format='wav')
+        output[(k - 1) * hop_out:(k - 1) * hop_out + frame] += padded[pos + tolerance:pos + tolerance + frame] * window
+        pos = nominal - tolerance + offset
+    output[(n_frames - 1) * hop_out:(n_frames - 1) * hop_out + frame] += padded[pos + tolerance:pos + tolerance + frame] * window
 
-    duration = len(final_audio) / 1000.0
-    print(f"[process_audio] 音声処理完了 (長さ={duration:.1f}秒)")
+    return output[:int(len(samples) / speed)]
 
-    return output_path, duration
 
+def process_audio(pcm_data, output_path, speed=1.2, silence_before_ms=1000, silence_after_ms=500,
+                  sample_rate=TTS_SAMPLE_RATE):
+    """音声処理: 速度変換、無音追加、（任意）音量正規化
 
-def resize_image_for_video(image, target_size=(1920, 1080)):
-    """画像を動画用にリサイズ"""
-    target_w, target_h = target_size
+    TTSの生PCM(16bit mono)をNumPy配列のまま処理し、WAVを1回だけ書き出す。
+    """
+    print(f"[process_audio] 音声処理開始 (速度={speed}x, {AUDIO_SPEED_MODE})")
+    samples = np.frombuffer(pcm_data, dtype=np.int16).astype(np.float32)
 
-    img_ratio = image.width / image.height
-    target_ratio = target_w / target_h
+    if speed != 1.0 and len(samples) > 1:
+        if AUDIO_SPEED_MODE == "wsola":
+            samples = time_stretch_wsola(samples, speed, sample_rate)
+        else:
+            # サンプルレート読み替えと同等の線形補間リサンプル
+            new_length = int(len(samples) / speed)
+            positions = np.linspace(0, len(samples) - 1, new_length)
+            samples = np.interp(positions, np.arange(len(samples)), samples)
+
+    if AUDIO_NORMALIZE_DBFS is not None and len(samples):
+        rms = np.sqrt(np.mean(samples ** 2))
+        if rms > 0:
+            gain = (32768.0 * 10 ** (AUDIO_NORMALIZE_DBFS / 20)) / rms
+            peak = np.max(np.abs(samples))
+            samples = samples * min(gain, 32767.0 / peak)  # クリップしない範囲に制限
+
+    before = np.zeros(sample_rate * silence_before_ms // 1000, dtype=np.int16)
+    after = np.zeros(sample_rate * silence_after_ms // 1000, dtype=np.int16)
+    voice = np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+    final_audio = np.concatenate([before, voice, after])
+
+    save_pcm_to_wav(final_audio.tobytes(), output_path, sample_rate=sample_rate)
+
+    duration = len(final_audio) / sample_rate
+    print(f"[process_audio] 音声処理完了 (長さ={duration:.1f}秒)")
 
-    if img_ratio > target_ratio:
-        new_w = target_w
-        new_h = int(target_w / img_ratio)
-    else:
-        new_h = target_h
-        new_w = int(target_h * img_ratio)
+    return output_path, duration
 
-    resized = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
 
-    result = Image.new('RGB', target_size, (0, 0, 0))
-    offset = ((target_w - new_w) // 2, (target_h - new_h) // 2)
-    result.paste(resized, offset)
+def run_ffmpeg(cmd, tag, input_data=None):
+    """ffmpegを実行し、失敗時はstderr付きで例外を送出（input_dataは標準入力へ渡す）
 
+    エンコードはCPUを使い切るため、全ジョブ共通のENCODE_SLOTSで同時実行数を制限する。
+    """
+    with ENCODE_SLOTS:
+        result = subprocess.run(cmd, input=input_data, capture_output=True)
+    if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="replace")
+        print(f"[{tag}] ffmpegエラー: {stderr[-2000:]}")
+        raise RuntimeError(f"ffmpeg failed ({tag}): returncode={result.returncode}")
     return result
 
 
-def create_page_video(image, audio_path, duration):
-    """ページ動画を作成"""
-    print(f"[create_video] ページ動画作成開始 (長さ={duration:.1f}秒)")
-    resized_img = resize_image_for_video(image, OUTPUT_RESOLUTION)
-
-    img_path = tempfile.mktemp(suffix='.png')
-    resized_img.save(img_path)
+def still_image_encode_args():
+    """静止画向けの共通エンコード設定（セグメント/一括レンダリング共通）"""
+    gop = OUTPUT_FPS * VIDEO_GOP_SECONDS
+    return [
+        '-c:v', 'libx264',
+        '-preset', VIDEO_PRESET,
+        '-tune', 'stillimage',
+        '-pix_fmt', 'yuv420p',
+        '-r', str(OUTPUT_FPS),
+        '-g', str(gop),
+        '-keyint_min', str(gop),
+        '-sc_threshold', '0',
+        '-c:a', 'aac',
+        '-b:a', AUDIO_BITRATE,
+        '-ar', str(AUDIO_SAMPLE_RATE),
+        '-ac', '2',
+    ]
 
-    img_clip = ImageClip(img_path, duration=duration)
-    audio_clip = AudioFileClip(audio_path)
 
-    video = img_clip.with_audio(audio_clip)
+def create_page_video(frame, audio_path, duration, output_path):
+    """ページ動画を作成（生RGBフレームをffmpegへパイプ、PNG経由なし）"""
+    print(f"[create_video] ページ動画作成開始 (長さ={duration:.1f}秒)")
+    width, height = OUTPUT_RESOLUTION
 
-    output_path = tempfile.mktemp(suffix='.mp4')
-    video.write_videofile(
-        output_path,
-        fps=OUTPUT_FPS,
-        codec='libx264',
-        audio_codec='aac',
-        logger="bar"
-    )
+    # 1フレームをloopフィルタで繰り返す
+    # 全セグメントで同一パラメータ → merge_videosでstream copy結合可能
+    # 複数セグメントを並列エンコードするため、1本あたりのスレッド数はENCODE_THREADSに抑える
+    cmd = [
+        FFMPEG_BIN, '-y',
+        '-f', 'rawvideo',
+        '-pix_fmt', 'rgb24',
+        '-s', f"{width}x{height}",
+        '-framerate', str(OUTPUT_FPS),
+        '-i', 'pipe:0',
+        '-i', audio_path,
+        '-vf', 'loop=loop=-1:size=1',
+        *still_image_encode_args(),
+        '-threads', str(ENCODE_THREADS),
+        '-filter_threads', '1',
+        '-t', f"{duration:.3f}",
+        output_path
+    ]
 
-    img_clip.close()
-    audio_clip.close()
-    os.remove(img_path)
+    run_ffmpeg(cmd, "create_video", input_data=frame)
     print(f"[create_video] ページ動画作成完了")
 
     return output_path
@@ -506,10 +1324,8 @@ def create_page_video(image, audio_path, duration):
 
 def merge_videos(video_paths, output_path):
     """動画を結合（ffmpeg直接結合で高速化）"""
-    import subprocess
-
-    # ファイルリストを作成
-    list_path = tempfile.mktemp(suffix='.txt')
+    # ファイルリストを作成（出力と同じジョブディレクトリに置く）
+    list_path = f"{output_path}.concat.txt"
     with open(list_path, 'w') as f:
         for path in video_paths:
             # ffmpeg concat demuxer形式
@@ -517,7 +1333,7 @@ def merge_videos(video_paths, output_path):
 
     # ffmpegで再エンコードなしに結合（超高速）
     cmd = [
-        'ffmpeg', '-y',
+        FFMPEG_BIN, '-y',
         '-f', 'concat',
         '-safe', '0',
         '-i', list_path,
@@ -526,6 +1342,14 @@ def merge_videos(video_paths, output_path):
     ]
 
     print(f"[merge_videos] ffmpeg直接結合開始: {len(video_paths)}本の動画")
+    try:
+        _concat_or_fallback(cmd, video_paths, output_path)
+    finally:
+        os.remove(list_path)
+
+
+def _concat_or_fallback(cmd, video_paths, output_path):
+    """concat demuxerで結合し、失敗時はmoviepyで再エンコード結合"""
     result = subprocess.run(cmd, capture_output=True, text=True)
 
     if result.returncode != 0:
@@ -547,17 +1371,91 @@ def merge_videos(video_paths, output_path):
     else:
         print(f"[merge_videos] ffmpeg結合完了")
 
-    # クリーンアップ
-    os.remove(list_path)
+
+def concat_wav_files(wav_paths, output_path):
+    """同一フォーマットのWAVを1本に連結"""
+    with wave.open(output_path, "wb") as out:
+        params = None
+        for path in wav_paths:
+            with wave.open(path, "rb") as wf:
+                if params is None:
+                    params = wf.getparams()
+                    out.setnchannels(params.nchannels)
+                    out.setsampwidth(params.sampwidth)
+                    out.setframerate(params.framerate)
+                elif wf.getparams()[:3] != params[:3]:
+                    raise ValueError(f"WAVフォーマット不一致: {path}")
+                out.writeframes(wf.readframes(wf.getnframes()))
+
+
+def write_png(frame, size, path):
+    """生RGBフレームをPNGとして保存（スライドは無圧縮PPMの数十分の一のサイズ）"""
+    width, height = size
+    fitz.Pixmap(fitz.csRGB, width, height, frame, 0).save(path)
+
+
+def render_single_pass(rasterizer, page_audio, output_path):
+    """全ページを1回のffmpeg呼び出しでエンコード（画像concat + 連結音声）
+
+    page_audio: ページ順の (音声パス, 長さ) リスト
+    """
+    print(f"[render_single_pass] 一括レンダリング開始: {len(page_audio)}ページ")
+    work_dir = tempfile.mkdtemp(prefix='single_pass_', dir=os.path.dirname(os.path.abspath(output_path)))
+    list_path = os.path.join(work_dir, 'images.txt')
+    audio_path = os.path.join(work_dir, 'audio.wav')
+
+    try:
+        with open(list_path, 'w') as f:
+            img_path = None
+            for i, (_, duration) in enumerate(page_audio):
+                # 全ページ分がffmpeg起動前にディスクに揃うため圧縮して置く
+                # （無圧縮PPMでは1ページ約2.8MB、500ページで1.4GBになる）
+                img_path = os.path.join(work_dir, f'page_{i:04d}.png')
+                write_png(rasterizer.render_frame(i + 1), OUTPUT_RESOLUTION, img_path)
+                f.write(f"file '{img_path}'\n")
+                f.write(f"duration {duration:.3f}\n")
+            # concat demuxerは最後のdurationを反映させるため末尾ファイルの再指定が必要
+            if img_path:
+                f.write(f"file '{img_path}'\n")
+
+        concat_wav_files([audio for audio, _ in page_audio], audio_path)
+        total_duration = sum(duration for _, duration in page_audio)
+
+        cmd = [
+            FFMPEG_BIN, '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', list_path,
+            '-i', audio_path,
+            *still_image_encode_args(),
+            '-t', f"{total_duration:.3f}",
+            '-movflags', '+faststart',
+            output_path
+        ]
+        run_ffmpeg(cmd, "render_single_pass")
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+
+    print(f"[render_single_pass] 一括レンダリング完了 (長さ={total_duration:.1f}秒)")
+
+
+def upload_name(job_id=""):
+    """アップロード先のファイル名（拡張子なし）
+
+    同時実行のジョブが同じ秒に名前を作っても衝突しないようジョブIDを付ける。
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"pdf_movie_{timestamp}_{job_id}" if job_id else f"pdf_movie_{timestamp}"
 
 
-def upload_to_hf_dataset(video_path, hf_token, repo_id):
+def upload_to_hf_dataset(video_path, hf_token, repo_id, name=None):
     """HFにアップロード"""
     print(f"[upload] HFアップロード開始: {repo_id}")
     api = HfApi()
 
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"pdf_movie_{timestamp}.mp4"
+    filename = f"{name or upload_name()}.mp4"
 
     url = api.upload_file(
         path_or_fileobj=video_path,
@@ -571,146 +1469,1006 @@ def upload_to_hf_dataset(video_path, hf_token, repo_id):
     return url
 
 
-def process_pdf_to_movie(pdf_file, program_style_name, gemini_api_key, hf_token, hf_repo_id, progress=gr.Progress()):
-    """メイン処理"""
-    print(f"=" * 50)
-    print(f"[main] PDF→動画変換開始")
-    print(f"[main] スタイル: {program_style_name}")
-    print(f"=" * 50)
-
-    if pdf_file is None:
-        return None, "PDFファイルをアップロードしてください", ""
-
-    api_key = gemini_api_key or ENV_GEMINI_API_KEY
-    token = hf_token or ENV_HF_TOKEN
-    repo_id = hf_repo_id or ENV_HF_REPO_ID
-
-    if not api_key:
-        return None, "Gemini APIキーを入力してください", ""
-
-    if not token or not repo_id:
-        return None, "HFトークンとリポジトリIDを入力してください", ""
-
+# ===========================
+# ジョブチェックポイント
+# ===========================
+class JobCancelled(Exception):
+    """ユーザー操作などでジョブが中断された"""
+
+
+def raise_if_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled("ジョブがキャンセルされました")
+
+
+class JobManifest:
+    """ジョブディレクトリとページ単位の完了ステージ記録（中断からの再開用）
+
+    pages[ページ番号] に script（フォールバックならscript_fallback）/ pcm / audio+duration / segment を記録し、
+    同じジョブIDで再実行すると完了済みステージをスキップする。
+    """
+
+    def __init__(self, job_id, pdf_sha256, style_name, total_pages):
+        self.job_id = job_id
+        self.dir = Path(JOBS_DIR) / job_id
+        self.path = self.dir / "manifest.json"
+        self.lock = threading.Lock()
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        # 出力に影響する設定が変わったら再利用しない
+        identity = {
+            "pdf_sha256": pdf_sha256,
+            "style": style_name,
+            "total_pages": total_pages,
+            "settings": job_settings(),
+        }
+        data = None
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"[job] マニフェスト読込失敗、新規作成: {e}")
+
+        if data and all(data.get(k) == v for k, v in identity.items()):
+            done = sum(1 for p in data["pages"].values() if "audio" in p or "segment" in p)
+            print(f"[job] 再開: {job_id} (音声完了 {done}/{total_pages}ページ)")
+        else:
+            data = {"job_id": job_id, **identity, "pages": {}}
+            print(f"[job] 新規ジョブ: {job_id}")
+        self.data = data
+        self._save()
+
+    def _save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.data, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def page(self, page_num):
+        with self.lock:
+            return dict(self.data["pages"].get(str(page_num), {}))
+
+    def update(self, page_num, **fields):
+        with self.lock:
+            self.data["pages"].setdefault(str(page_num), {}).update(fields)
+            self._save()
+
+    def file_path(self, page_num, suffix):
+        return str(self.dir / f"page_{page_num:04d}{suffix}")
+
+    def discard(self, page_num, stage):
+        """消費済みの中間ファイルを削除（ディスク節約）"""
+        with self.lock:
+            page = self.data["pages"].get(str(page_num), {})
+            name = page.pop(stage, None)
+            if name is None:
+                return
+            self._save()
+        (self.dir / name).unlink(missing_ok=True)
+
+    @property
+    def outputs_dir(self):
+        """完成動画・計測レポートの置き場（clear_scratchの対象外、WorkspaceManagerが整理）"""
+        path = self.dir / "outputs"
+        path.mkdir(exist_ok=True)
+        return path
+
+    def clear_scratch(self, keep=()):
+        """チェックポイント（マニフェストが参照するファイル）と出力以外を削除
+
+        中断時の書きかけファイル・一時ディレクトリを片付ける。outputs/ には
+        先行の同一ジョブがこれからアップロードする動画があり得るため触らない。
+        """
+        with self.lock:
+            referenced = {"manifest.json", "outputs", *keep}
+            for page in self.data["pages"].values():
+                referenced.update(page[stage] for stage in ("pcm", "audio", "segment") if page.get(stage))
+        removed = 0
+        for path in self.dir.iterdir():
+            if path.name in referenced:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            removed += 1
+        if removed:
+            print(f"[job] 作業ファイル削除: {removed}件")
+
+    def set_fingerprints(self, fingerprints):
+        with self.lock:
+            self.data["fingerprints"] = fingerprints
+            self._save()
+
+    def has(self, page_num, stage):
+        """ステージが完了済みか（ファイル系ステージは実体の存在も確認）"""
+        value = self.page(page_num).get(stage)
+        if value is None:
+            return False
+        if stage in ("pcm", "audio", "segment"):
+            return os.path.exists(self.dir / value)
+        return True
+
+    def is_page_done(self, page_num):
+        if RENDER_MODE == "single_pass":
+            return self.has(page_num, "audio")
+        return self.has(page_num, "segment")
+
+
+def job_settings():
+    """ジョブの成果物（音声・動画）に影響する設定値"""
+    return [AUDIO_SPEED, AUDIO_SPEED_MODE, SILENCE_BEFORE, SILENCE_AFTER, AUDIO_NORMALIZE_DBFS, list(OUTPUT_RESOLUTION), OUTPUT_FPS]
+
+
+def link_or_copy(src, dst):
+    """ハードリンクで共有（別ファイルシステムならコピー）"""
     try:
-        pdf_path = pdf_file
-        program_style = PROGRAM_STYLES.get(program_style_name, PROGRAM_STYLES["1人ラジオ風"])
-
-        progress(0.05, desc="PDFを分割中...")
-        chunks = split_pdf(pdf_path, PAGES_PER_CHUNK)
-        total_pages = sum(len(pages) for _, pages in chunks)
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
 
-        progress(0.1, desc=f"PDF分割完了: {total_pages}ページ")
 
-        all_images = pdf_to_images(pdf_path)
+def find_base_job(job, base_job_id=""):
+    """差分再生成の元になる前回ジョブのマニフェストを探す
 
-        all_scripts = {}
-        total_chunks = len(chunks)
-        for i, (chunk_path, page_numbers) in enumerate(chunks):
-            chunk_index = i + 1  # 1-indexed
-            progress(0.1 + (0.3 * i / len(chunks)),
-                    desc=f"台本生成中... {chunk_index}/{total_chunks}")
+    base_job_id指定時はそれを、なければ同じスタイル・設定のジョブのうち
+    ページ指紋の一致が最も多いものを返す（見つからなければNone）。
+    """
+    fingerprints = set(job.data.get("fingerprints") or [])
+    if base_job_id:
+        paths = [Path(JOBS_DIR) / base_job_id / "manifest.json"]
+    else:
+        paths = sorted(Path(JOBS_DIR).glob("*/manifest.json"), key=lambda p: p.stat().st_mtime, reverse=True)
 
-            scripts = generate_narration_script(
-                chunk_path, page_numbers, program_style, api_key,
-                chunk_index=chunk_index, total_chunks=total_chunks, total_pages=total_pages
+    best, best_matches = None, 0
+    for path in paths:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            continue
+        if data.get("job_id") == job.job_id or data.get("style") != job.data["style"]:
+            continue
+        if data.get("settings") != job.data["settings"]:
+            continue
+        matches = len(fingerprints & set(data.get("fingerprints") or []))
+        if matches > best_matches:
+            best, best_matches = data, matches
+    return best
+
+
+def reuse_unchanged_pages(job, base_job_id=""):
+    """前回ジョブから指紋が一致するページの成果物を引き継ぎ、再利用したページ数を返す
+
+    ページの並べ替え・挿入・削除にも対応する（指紋で対応付け）。ただし先頭・末尾の
+    ページは導入・締めくくりの台本を含むため、同じ位置のページからのみ引き継ぐ。
+    台本がフォールバック（生成失敗時の定型文）のページは引き継がず作り直す。
+    """
+    if job.data["pages"]:
+        return 0  # 同じジョブの再開時は既存の記録を優先
+    base = find_base_job(job, base_job_id)
+    if base is None:
+        return 0
+
+    base_dir = Path(JOBS_DIR) / base["job_id"]
+    base_total = base["total_pages"]
+    base_pages = {}
+    for page_num, fingerprint in enumerate(base["fingerprints"], start=1):
+        page = base["pages"].get(str(page_num), {})
+        if page.get("script") is not None and not page.get("script_fallback"):
+            base_pages.setdefault(fingerprint, []).append((page_num, page))
+
+    fingerprints = job.data["fingerprints"]
+    total_pages = len(fingerprints)
+    reused = 0
+    for page_num, fingerprint in enumerate(fingerprints, start=1):
+        candidates = base_pages.get(fingerprint, [])
+        if page_num == 1:
+            candidates = [c for c in candidates if c[0] == 1]
+        elif page_num == total_pages:
+            candidates = [c for c in candidates if c[0] == base_total]
+        else:
+            candidates = [c for c in candidates if c[0] not in (1, base_total)]
+        if not candidates:
+            continue
+        # 同じページ番号があれば優先
+        _, page = min(candidates, key=lambda c: abs(c[0] - page_num))
+
+        fields = {"script": page["script"]}
+        for stage, suffix in (("pcm", ".pcm"), ("audio", ".wav"), ("segment", ".mp4")):
+            src = base_dir / page[stage] if page.get(stage) else None
+            if src is not None and src.exists():
+                dst = job.file_path(page_num, suffix)
+                link_or_copy(src, dst)
+                fields[stage] = os.path.basename(dst)
+        if "duration" in page:
+            fields["duration"] = page["duration"]
+        job.update(page_num, **fields)
+        reused += 1
+
+    print(f"[job] 差分再生成: {base['job_id']} から {reused}/{total_pages}ページを再利用")
+    return reused
+
+
+JOB_LOCKS = {}
+JOB_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def job_lock(job_id):
+    """同じジョブIDの同時実行を直列化（後発は先行ジョブの成果物を再利用して完了する）"""
+    with JOB_LOCKS_GUARD:
+        lock = JOB_LOCKS.setdefault(job_id, threading.Lock())
+    if not lock.acquire(blocking=False):
+        print(f"[job] {job_id} は実行中のため完了を待機")
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def compute_job_id(pdf_path, style_name):
+    """PDF内容と番組スタイルから既定のジョブIDを生成"""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    pdf_sha256 = digest.hexdigest()
+    job_id = hashlib.sha256(f"{pdf_sha256}:{style_name}".encode("utf-8")).hexdigest()[:16]
+    return job_id, pdf_sha256
+
+
+class WorkspaceManager:
+    """JOBS_DIR全体のディスク使用量を上限内に保つ
+
+    上限を超えたら、まずoutputs_keep_secondsより古い完成動画・レポートを削除し、
+    それでも超える分は最後に更新されたのが古いジョブから丸ごと削除する。
+    実行中のジョブ（job_lock保持中）は削除しない。
+    """
+
+    def __init__(self, root, max_bytes, outputs_keep_seconds=OUTPUTS_KEEP_SECONDS):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.outputs_keep_seconds = outputs_keep_seconds
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _dir_size(path):
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+    def enforce(self):
+        """上限超過分を古いジョブから削除し、削除したジョブIDのリストを返す"""
+        with self.lock:
+            if not self.root.exists():
+                return []
+            with JOB_LOCKS_GUARD:
+                active = {job_id for job_id, lock in JOB_LOCKS.items() if lock.locked()}
+            jobs = []
+            for path in self.root.iterdir():
+                if path.is_dir():
+                    manifest = path / "manifest.json"
+                    mtime = (manifest if manifest.exists() else path).stat().st_mtime
+                    jobs.append((mtime, path, self._dir_size(path)))
+            total = sum(size for _, _, size in jobs)
+            if total <= self.max_bytes:
+                return []
+
+            # 完成動画はアップロード・返却済みなので、チェックポイントより先に手放す
+            cutoff = time.time() - self.outputs_keep_seconds
+            outputs = sorted(
+                (p.stat().st_mtime, p) for p in self.root.glob("*/outputs/*") if p.is_file()
             )
-            all_scripts.update(scripts)
-            os.remove(chunk_path)
-
-        progress(0.4, desc="音声生成中...")
+            swept = 0
+            for mtime, path in outputs:
+                if total <= self.max_bytes or mtime > cutoff:
+                    break
+                size = path.stat().st_size
+                path.unlink(missing_ok=True)
+                total -= size
+                swept += 1
+            if swept:
+                print(f"[workspace] 上限超過のため古い出力を削除: {swept}件")
+                jobs = [(mtime, path, self._dir_size(path)) for mtime, path, _ in jobs]
+
+            evicted = []
+            for _, path, size in sorted(jobs, key=lambda j: j[0]):
+                if total <= self.max_bytes:
+                    break
+                if path.name in active:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                evicted.append(path.name)
+            if evicted:
+                print(f"[workspace] 上限超過のためジョブ削除: {evicted} (現在 {total / 1e9:.2f}GB)")
+            return evicted
+
+
+WORKSPACE = WorkspaceManager(JOBS_DIR, JOBS_MAX_BYTES)
 
-        page_data = []
-        for i, page_num in enumerate(range(1, total_pages + 1)):
-            progress(0.4 + (0.4 * i / total_pages),
-                    desc=f"音声生成中... {page_num}/{total_pages}")
 
-            script = all_scripts.get(page_num)
+# ===========================
+# 段階的配信
+# ===========================
+class PartUploader:
+    """配信用パーツをバックグラウンドでHF Datasetにアップロード
+
+    溜まったファイルをPART_UPLOAD_INTERVAL秒ごとに1コミットでまとめて送る。
+    失敗してもプレビュー用なので変換は止めない。
+    """
+
+    def __init__(self, hf_token, repo_id, prefix, interval=PART_UPLOAD_INTERVAL):
+        self.api = HfApi()
+        self.hf_token = hf_token
+        self.repo_id = repo_id
+        self.prefix = prefix
+        self.interval = interval
+        self.pending = {}  # path_in_repo -> ローカルパス
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def url(self, filename):
+        return f"https://huggingface.co/datasets/{self.repo_id}/resolve/main/{self.prefix}/{filename}"
+
+    def add(self, local_path):
+        with self.cond:
+            self.pending[f"{self.prefix}/{Path(local_path).name}"] = str(local_path)
+            self.cond.notify()
+
+    def _run(self):
+        last_commit = 0.0
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                wait = last_commit + self.interval - time.monotonic()
+                if wait > 0 and not self.closed:
+                    self.cond.wait(wait)
+                    continue
+                batch, self.pending = self.pending, {}
+            try:
+                self.api.create_commit(
+                    repo_id=self.repo_id,
+                    repo_type="dataset",
+                    operations=[CommitOperationAdd(path_in_repo=k, path_or_fileobj=v) for k, v in batch.items()],
+                    commit_message=f"Add {len(batch)} stream parts",
+                    token=self.hf_token
+                )
+                print(f"[upload] 部分アップロード: {len(batch)}ファイル")
+            except Exception as e:
+                print(f"[upload] 部分アップロード失敗（続行）: {e}")
+            last_commit = time.monotonic()
+
+    def close(self):
+        """残りをアップロードして終了"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+
+class ProgressiveStream:
+    """完成したページ動画を先頭から順にHLS（MPEG-TS＋m3u8）として書き出す
+
+    ページは並列に完成するため、先頭から連続して揃った分だけ配信する。
+    書き出したTSファイルはpartsキューでUIへ、uploaderでHFへ渡す。
+    """
+
+    def __init__(self, uploader=None):
+        self.uploader = uploader
+        self.parts = queue.Queue()
+        self.lock = threading.Lock()
+        self.job = None
+        self.done = set()
+        self.next_page = 1
+        self.offset = 0.0
+        self.entries = []
+        self.failed = False
+
+    def page_done(self, job, page_num):
+        """ページ完成の通知（エンコーダースレッドから呼ばれる）"""
+        with self.lock:
+            if self.job is None:
+                self.job = job
+                self.dir = job.dir / "stream"
+                self.dir.mkdir(exist_ok=True)
+                self.playlist = self.dir / "index.m3u8"
+            self.done.add(page_num)
+            try:
+                while not self.failed and self.next_page in self.done and job.has(self.next_page, "segment"):
+                    self._emit(self.next_page)
+                    self.next_page += 1
+            except Exception as e:
+                self.failed = True  # プレビューのみ停止し、変換は続行
+                print(f"[stream] 配信停止: {e}")
+
+    def _emit(self, page_num):
+        page = self.job.page(page_num)
+        ts_path = self.dir / f"page_{page_num:04d}.ts"
+        # stream copyでTSへ詰め替え、タイムスタンプを前のページの続きにずらす
+        run_ffmpeg([
+            FFMPEG_BIN, '-y',
+            '-i', str(self.job.dir / page["segment"]),
+            '-c', 'copy',
+            '-bsf:v', 'h264_mp4toannexb',
+            '-output_ts_offset', f"{self.offset:.3f}",
+            '-f', 'mpegts',
+            str(ts_path)
+        ], "stream")
+        self.offset += page["duration"]
+        self.entries.append((ts_path.name, page["duration"]))
+        self._write_playlist(ended=False)
+        self.parts.put(str(ts_path))
+        if self.uploader:
+            self.uploader.add(ts_path)
+            self.uploader.add(self.playlist)
+
+    def _write_playlist(self, ended):
+        target = max(d for _, d in self.entries)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-PLAYLIST-TYPE:EVENT",
+                 f"#EXT-X-TARGETDURATION:{int(target) + 1}", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for name, duration in self.entries:
+            lines += [f"#EXTINF:{duration:.3f},", name]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        tmp_path = self.playlist.with_suffix(".tmp")
+        tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp_path, self.playlist)
+
+    def close(self):
+        """全ページ配信後にプレイリストを閉じ、残りのアップロードを待つ
+
+        UIがまだpartsキューから受け取っていないパーツがあり得るため、ここでは削除しない。
+        """
+        with self.lock:
+            if self.entries and not self.failed:
+                self._write_playlist(ended=True)
+                if self.uploader:
+                    self.uploader.add(self.playlist)
+        if self.uploader:
+            self.uploader.close()
+
+    def cleanup(self):
+        """partsキューを読み終えた後にパーツを削除（残った分は次回のclear_scratchが片付ける）"""
+        if self.job is not None:
+            shutil.rmtree(self.dir, ignore_errors=True)
 
-            if program_style["speakers"] == 1:
-                narration = script if isinstance(script, str) else f"ページ{page_num}です。"
-                host_config = program_style["speaker_config"]["host"]
 
-                pcm_data = text_to_speech_single(
-                    narration,
-                    host_config["voice"],
-                    program_style.get("tts_style", "自然に読み上げてください。"),
-                    api_key
-                )
+# ===========================
+# ストリーミングパイプライン
+# ===========================
+def finish_page(page_num, pcm_data, rasterizer, job, trace):
+    """TTS済みページの音声処理と（セグメントモードでは）動画エンコード"""
+    if not job.has(page_num, "audio"):
+        with trace.stage("process_audio", page_num) as record:
+            audio_path, duration = process_audio(
+                pcm_data, job.file_path(page_num, ".wav"), AUDIO_SPEED, SILENCE_BEFORE, SILENCE_AFTER
+            )
+            record["bytes"] = os.path.getsize(audio_path)
+        job.update(page_num, audio=os.path.basename(audio_path), duration=duration)
+    job.discard(page_num, "pcm")  # WAVができたら生PCMは不要
+
+    if RENDER_MODE == "single_pass" or job.has(page_num, "segment"):
+        return
+
+    page = job.page(page_num)
+    with trace.stage("rasterize", page_num) as record:
+        frame = rasterizer.render_frame(page_num)
+        record["bytes"] = len(frame)
+    with trace.stage("create_page_video", page_num) as record:
+        video_path = create_page_video(
+            frame, str(job.dir / page["audio"]), page["duration"],
+            output_path=job.file_path(page_num, ".mp4")
+        )
+        record["bytes"] = os.path.getsize(video_path)
+    job.update(page_num, segment=os.path.basename(video_path))
+    job.discard(page_num, "audio")  # 音声はセグメントに含まれる（長さは記録に残す）
+
+
+def run_page_pipeline(chunks, program_style, key_pool, total_pages, rasterizer, job, trace, progress,
+                      on_page_done=None, cancel=None):
+    """台本生成→TTS→音声処理→エンコードをページ単位で重ねて実行
+
+    台本が完成したチャンクから順にTTSを投入し、音声が届いたページから
+    有界キュー経由でENCODE_WORKERS本のエンコーダーへ流す。
+    完了済みステージはjobから再利用する。on_page_done(ページ番号)はページ完成ごと
+    （完了済みページは開始時）に呼ばれる。cancelがセットされると
+    未着手の台本・TTS・エンコードを打ち切ってJobCancelledを送出する。
+    """
+    total_chunks = len(chunks)
+    encode_queue = queue.Queue(maxsize=max(PIPELINE_QUEUE_SIZE, ENCODE_WORKERS))
+    completed = [sum(1 for p in range(1, total_pages + 1) if job.is_page_done(p))]
+    completed_lock = threading.Lock()
+    errors = []
+
+    def tts_worker(page_nums):
+        raise_if_cancelled(cancel)
+        pending = [(p, job.page(p).get("script")) for p in page_nums
+                   if not job.has(p, "audio") and not job.has(p, "pcm")]
+        synthesized = {}
+        if pending:
+            with trace.stage("tts", [p for p, _ in pending]) as record:
+                synthesized = synthesize_pages(pending, program_style, key_pool)
+                record["bytes"] = sum(len(pcm) for pcm in synthesized.values())
+
+        for page_num in page_nums:
+            if page_num in synthesized:
+                pcm_data = synthesized[page_num]
+                pcm_path = job.file_path(page_num, ".pcm")
+                Path(pcm_path).write_bytes(pcm_data)
+                job.update(page_num, pcm=os.path.basename(pcm_path))
+            elif job.has(page_num, "audio"):
+                pcm_data = None
             else:
-                dialogue = script if isinstance(script, list) else [
-                    {"speaker": program_style["speaker_config"]["host"]["name"],
-                     "text": f"ページ{page_num}について見ていきましょう。"}
-                ]
-
-                style_prompts = {
-                    "host": program_style.get("tts_style_host", "自然に話してください。"),
-                    "guest": program_style.get("tts_style_guest", "自然に話してください。")
-                }
-
-                pcm_data = text_to_speech_multi(
-                    dialogue,
-                    program_style["speaker_config"],
-                    style_prompts,
-                    api_key
+                pcm_data = Path(job.dir / job.page(page_num)["pcm"]).read_bytes()
+            encode_queue.put((page_num, pcm_data))  # キュー満杯なら待機（背圧）
+
+    def encode_worker():
+        while True:
+            item = encode_queue.get()
+            if item is None:
+                return
+            if errors or (cancel is not None and cancel.is_set()):
+                continue  # 失敗・キャンセル後はキューを空にするだけ（TTS側のputを詰まらせない）
+            page_num, pcm_data = item
+            try:
+                finish_page(page_num, pcm_data, rasterizer, job, trace)
+                with completed_lock:
+                    completed[0] += 1
+                if on_page_done:
+                    on_page_done(page_num)
+            except Exception as e:
+                errors.append(e)
+
+    # ffmpegは別プロセスなので、スレッドから複数起動すればCPUコアに並列に載る
+    if on_page_done:
+        for page_num in range(1, total_pages + 1):
+            if job.is_page_done(page_num):
+                on_page_done(page_num)
+
+    encoders = [threading.Thread(target=encode_worker, daemon=True) for _ in range(ENCODE_WORKERS)]
+    for encoder in encoders:
+        encoder.start()
+
+    script_pool = ThreadPoolExecutor(max_workers=SCRIPT_MAX_WORKERS)
+    tts_pool = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS)
+    try:
+        tts_futures = []
+
+        def script_worker(i, page_numbers):
+            raise_if_cancelled(cancel)
+            # 入力はチャンクごとに必要になってから作る（全チャンク分を同時に保持しない）
+            with trace.stage("build_script_input", page_numbers) as record:
+                with rasterizer.lock:  # fitzドキュメントはエンコーダーの描画と共有
+                    script_input = build_script_input(rasterizer.doc, page_numbers)
+                record["bytes"] = sum(len(data) for _, data in script_input)
+            with trace.stage("generate_narration_script", page_numbers) as record:
+                record["bytes"] = sum(len(data) for _, data in script_input)
+                return generate_narration_script(
+                    script_input, page_numbers, program_style, key_pool,
+                    chunk_index=i + 1, total_chunks=total_chunks, total_pages=total_pages
                 )
 
-            wav_path = tempfile.mktemp(suffix='.wav')
-            save_pcm_to_wav(pcm_data, wav_path)
+        def submit_pages(page_numbers):
+            remaining = [p for p in page_numbers if not job.is_page_done(p)]
+            for i in range(0, len(remaining), TTS_BATCH_PAGES):
+                tts_futures.append(tts_pool.submit(tts_worker, remaining[i:i + TTS_BATCH_PAGES]))
+
+        script_futures = {}
+        for i, page_numbers in enumerate(chunks):
+            if all(job.has(p, "script") for p in page_numbers):
+                submit_pages(page_numbers)  # 台本は前回実行分を再利用
+                continue
+            future = script_pool.submit(script_worker, i, page_numbers)
+            script_futures[future] = page_numbers
+
+        for done, future in enumerate(as_completed(script_futures), start=1):
+            scripts, fallback_pages = future.result()
+            for page_num in script_futures[future]:
+                if not job.has(page_num, "script"):  # 再利用ページの台本は上書きしない
+                    # フォールバック台本は記録して差分再生成で引き継がない（改訂版で再生成させる）
+                    fields = {"script_fallback": True} if page_num in fallback_pages else {}
+                    job.update(page_num, script=scripts.get(page_num), **fields)
+            submit_pages(script_futures[future])
+            progress(0.1 + (0.2 * done / len(script_futures)),
+                    desc=f"台本生成中... {done}/{len(script_futures)}")
+
+        for future in as_completed(tts_futures):
+            future.result()
+            if errors:
+                raise errors[0]
+            progress(0.3 + (0.6 * completed[0] / total_pages),
+                    desc=f"音声・動画作成中... {completed[0]}/{total_pages}")
+    finally:
+        script_pool.shutdown(wait=True, cancel_futures=True)
+        tts_pool.shutdown(wait=True, cancel_futures=True)
+        for encoder in encoders:
+            encode_queue.put(None)
+        for encoder in encoders:
+            encoder.join()
+
+    if errors:
+        raise errors[0]
+    raise_if_cancelled(cancel)
+
+    print(f"[pipeline] 全ページ完了: {completed[0]}ページ")
+
+
+def resolve_job_id(pdf_path, program_style_name, job_id=""):
+    """指定ジョブIDを正規化（空なら既定IDを使用）し、(ジョブID, PDFのSHA-256) を返す"""
+    default_job_id, pdf_sha256 = compute_job_id(pdf_path, program_style_name)
+    job_id = re.sub(r"[^A-Za-z0-9_-]", "_", (job_id or "").strip()) or default_job_id
+    return job_id, pdf_sha256
+
+
+def _no_progress(*args, **kwargs):
+    pass
+
+
+def run_report_path(video_path):
+    """動画と同じ場所に置く計測レポートのパス"""
+    return str(Path(video_path).with_suffix(".report.json"))
+
+
+def convert_pdf(pdf_path, program_style_name, key_pool, job_id, pdf_sha256, output_path=None, trace=None,
+                base_job_id="", stream=None, cancel=None, progress=_no_progress):
+    """PDF→動画変換の本体（Gradio UI・CLI共通、アップロードは含まない）
+
+    trace: ステージ別計測を記録するRunTrace（省略時は記録のみで破棄）
+    base_job_id: 差分再生成の元にする前回ジョブ（空なら指紋の一致が多いジョブを自動選択）
+    stream: 完成したページから順に配信するProgressiveStream（segmentsモードのみ）
+    cancel: セットされると処理を中断するthreading.Event
+    失敗・キャンセル時はチェックポイント以外の作業ファイルを削除する（再開は可能）。
+    戻り値: video_path / job_id / total_pages / reused_pages / retry_count / retry_wait の辞書
+    """
+    print(f"[main] ジョブID: {job_id}")
+    trace = trace or RunTrace(job_id)
+    retry_before = RETRY_STATS.snapshot()
+    program_style = PROGRAM_STYLES.get(program_style_name, PROGRAM_STYLES["1人ラジオ風"])
+
+    with job_lock(job_id):
+        progress(0.05, desc="PDFを分割中...")
+        doc = fitz.open(pdf_path)
+        job = None
+        final_video_path = None
+        try:
+            total_pages = len(doc)
+            job = JobManifest(job_id, pdf_sha256, program_style_name, total_pages)
+            job.clear_scratch()  # 中断時の書きかけファイル
+            WORKSPACE.enforce()
+
+            # ページ画像はエンコード時に1枚ずつ描画（全ページを保持しない）
+            rasterizer = PageRasterizer(doc)
+
+            reused_pages = 0
+            if INCREMENTAL_RENDER:
+                with trace.stage("fingerprint"):
+                    if not job.data.get("fingerprints"):
+                        job.set_fingerprints([rasterizer.fingerprint(p) for p in range(1, total_pages + 1)])
+                    reused_pages = reuse_unchanged_pages(job, base_job_id)
+
+            with trace.stage("split_pdf") as record:
+                # 台本が揃っているチャンク（再開・差分再生成）はサイズを計測しない
+                chunks = split_pdf(doc, PAGES_PER_CHUNK, max_bytes=CHUNK_MAX_BYTES,
+                                   skip=lambda page_numbers: all(job.has(p, "script") for p in page_numbers))
+                record["chunks"] = len(chunks)
+
+            progress(0.1, desc=f"PDF分割完了: {total_pages}ページ")
+
+            on_page_done = None
+            if stream is not None and RENDER_MODE != "single_pass":
+                on_page_done = lambda page_num: stream.page_done(job, page_num)
+            run_page_pipeline(chunks, program_style, key_pool, total_pages, rasterizer, job, trace, progress,
+                              on_page_done=on_page_done, cancel=cancel)
+            raise_if_cancelled(cancel)
+
+            if output_path:
+                final_video_path = output_path
+            else:
+                # 同一ジョブの再実行と出力が衝突しないよう一意な名前にする
+                fd, final_video_path = tempfile.mkstemp(prefix="output_", suffix=".mp4", dir=job.outputs_dir)
+                os.close(fd)
+            pages = [job.page(p) for p in range(1, total_pages + 1)]
+
+            if RENDER_MODE == "single_pass":
+                progress(0.9, desc="動画作成中（一括レンダリング）...")
+                page_audio = [(str(job.dir / page["audio"]), page["duration"]) for page in pages]
+                with trace.stage("render_single_pass") as record:
+                    render_single_pass(rasterizer, page_audio, final_video_path)
+                    record["bytes"] = os.path.getsize(final_video_path)
+            else:
+                progress(0.95, desc="動画結合中...")
+
+                video_paths = [str(job.dir / page["segment"]) for page in pages]
+                with trace.stage("merge_videos") as record:
+                    merge_videos(video_paths, final_video_path)
+                    record["bytes"] = os.path.getsize(final_video_path)
+        except BaseException:
+            if job is not None:
+                job.clear_scratch(keep=("stream",))  # 配信中のパーツはUIが読み終えてから片付ける
+            if final_video_path:
+                Path(final_video_path).unlink(missing_ok=True)  # 書きかけの出力
+            raise
+        finally:
+            doc.close()
+            WORKSPACE.enforce()
+
+    retry_after = RETRY_STATS.snapshot()
+    retry_count = sum(retry_after["retries"].values()) - sum(retry_before["retries"].values())
+    retry_wait = retry_after["wait_seconds"] - retry_before["wait_seconds"]
+    print(f"[main] リトライ: {retry_count}回, 待機 {retry_wait:.1f}秒 {retry_after['retries']}")
+    print(f"[main] APIキー: {len(key_pool.keys)}本 {key_pool.stats()}")
+    if ARTIFACT_CACHE:
+        print(f"[main] キャッシュ: {ARTIFACT_CACHE.stats()}")
+
+    return {
+        "video_path": final_video_path,
+        "job_id": job_id,
+        "total_pages": total_pages,
+        "reused_pages": reused_pages,
+        "retry_count": retry_count,
+        "retry_wait": retry_wait,
+    }
 
-            processed_path, duration = process_audio(wav_path, AUDIO_SPEED, SILENCE_BEFORE, SILENCE_AFTER)
-            os.remove(wav_path)
 
-            page_data.append((all_images[page_num - 1], processed_path, duration))
+def process_pdf_to_movie(pdf_file, program_style_name, gemini_api_key, hf_token, hf_repo_id, job_id="", base_job_id="", progress=gr.Progress()):
+    """メイン処理（Gradio UI用）
 
-        progress(0.8, desc="動画作成中...")
+    (プレビュー用TS, 完成動画, ステータス, HF URL) をyieldするジェネレーター。
+    PROGRESSIVE_DELIVERYでは完成したページから順にプレビューへ流し、
+    部分アップロードもバックグラウンドで進める。
+    """
+    print(f"=" * 50)
+    print(f"[main] PDF→動画変換開始")
+    print(f"[main] スタイル: {program_style_name}")
+    print(f"=" * 50)
 
-        video_paths = []
-        for i, (image, audio_path, duration) in enumerate(page_data):
-            progress(0.8 + (0.15 * i / len(page_data)),
-                    desc=f"動画作成中... {i+1}/{len(page_data)}")
+    if pdf_file is None:
+        yield None, None, "PDFファイルをアップロードしてください", ""
+        return
 
-            video_path = create_page_video(image, audio_path, duration)
-            video_paths.append(video_path)
-            os.remove(audio_path)
+    api_keys = parse_api_keys(gemini_api_key) or ENV_GEMINI_API_KEYS
+    token = hf_token or ENV_HF_TOKEN
+    repo_id = hf_repo_id or ENV_HF_REPO_ID
 
-        progress(0.95, desc="動画結合中...")
+    if not api_keys:
+        yield None, None, "Gemini APIキーを入力してください", ""
+        return
+    key_pool = ApiKeyPool(api_keys)
 
-        final_video_path = tempfile.mktemp(suffix='.mp4')
-        merge_videos(video_paths, final_video_path)
+    if not token or not repo_id:
+        yield None, None, "HFトークンとリポジトリIDを入力してください", ""
+        return
+
+    job_id, pdf_sha256 = resolve_job_id(pdf_file, program_style_name, job_id)
+    trace = RunTrace(job_id)
+    name = upload_name(job_id)
+    uploader = PartUploader(token, repo_id, f"videos/{name}_stream") if PROGRESSIVE_DELIVERY else None
+    stream = ProgressiveStream(uploader) if PROGRESSIVE_DELIVERY else None
+    cancel = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = convert_pdf(pdf_file, program_style_name, key_pool, job_id, pdf_sha256, trace=trace,
+                                            base_job_id=(base_job_id or "").strip(), stream=stream, cancel=cancel,
+                                            progress=progress)
+        except Exception as e:
+            outcome["error"] = e
+            outcome["traceback"] = traceback.format_exc()
+        finally:
+            if stream:
+                stream.close()
+                stream.parts.put(None)
 
-        for path in video_paths:
-            os.remove(path)
+    # gr.Progressはcontextvarsからコールバックを引くため、現在のコンテキストを引き継いで実行
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+    worker.start()
+
+    try:
+        if stream:
+            delivered = 0
+            while True:
+                part = stream.parts.get()
+                if part is None:
+                    break
+                delivered += 1
+                yield part, None, f"生成中... 先頭{delivered}ページ分を再生できます", ""
+        worker.join()
+        if stream:
+            stream.cleanup()  # 最後にyieldしたパーツもGradioが読み込み済み
+    finally:
+        if worker.is_alive():
+            # 画面側で中断された（ジェネレーターが閉じられた）→ 変換を打ち切って作業ファイルを片付ける
+            print(f"[main] キャンセル: {job_id}")
+            cancel.set()
+
+    if "error" in outcome:
+        e = outcome["error"]
+        print(f"[main] エラー発生: {str(e)}")
+        print(outcome["traceback"])
+        error_msg = f"エラー: {str(e)}\n\nジョブID「{job_id}」で再実行すると完了済みページから再開します。\n\n{outcome['traceback']}"
+        yield None, None, error_msg, ""
+        return
+
+    try:
+        result = outcome["result"]
 
         progress(0.98, desc="HFにアップロード中...")
 
-        hf_url = upload_to_hf_dataset(final_video_path, token, repo_id)
+        with trace.stage("upload") as record:
+            record["bytes"] = os.path.getsize(result["video_path"])
+            hf_url = upload_to_hf_dataset(result["video_path"], token, repo_id, name=name)
+        report_path = trace.write(run_report_path(result["video_path"]), total_pages=result["total_pages"])
+        print(f"[main] 計測レポート: {report_path}")
 
         progress(1.0, desc="完了!")
 
         print(f"=" * 50)
         print(f"[main] 処理完了!")
-        print(f"[main] 総ページ数: {total_pages}")
+        print(f"[main] 総ページ数: {result['total_pages']}")
         print(f"[main] 保存先: {hf_url}")
         print(f"=" * 50)
 
+        program_style = PROGRAM_STYLES.get(program_style_name, PROGRAM_STYLES["1人ラジオ風"])
+        stream_line = f"\nストリーム(HLS): {uploader.url('index.m3u8')}" if stream and stream.entries else ""
         status_msg = f"""
 完了!
 
 処理情報:
-- 総ページ数: {total_pages}
+- 総ページ数: {result["total_pages"]}
 - 番組スタイル: {program_style_name}
 - 話者数: {program_style["speakers"]}人
+- ジョブID: {job_id}
+- 前回から再利用したページ: {result["reused_pages"]}
+- リトライ: {result["retry_count"]}回（待機 {result["retry_wait"]:.1f}秒）
 
-保存先: {hf_url}
+ステージ別時間:
+{trace.format_summary()}
+
+保存先: {hf_url}{stream_line}
 """
 
-        return final_video_path, status_msg, hf_url
+        yield None, result["video_path"], status_msg, hf_url
 
     except Exception as e:
         print(f"[main] エラー発生: {str(e)}")
         print(traceback.format_exc())
         error_msg = f"エラー: {str(e)}\n\n{traceback.format_exc()}"
-        return None, error_msg, ""
+        yield None, result["video_path"], error_msg, ""
+
+
+# ===========================
+# バッチ処理 / CLI
+# ===========================
+def load_batch_entries(input_path, default_style):
+    """バッチ入力を [{pdf, style, job_id, base_job_id, output}] に展開
+
+    input_path: PDFファイル / PDFを含むディレクトリ /
+                マニフェスト（.txt: 1行1パス、.json: オブジェクトのリスト）
+    """
+    path = Path(input_path)
+    if path.is_dir():
+        items = [{"pdf": str(p)} for p in sorted(path.glob("*.pdf"))]
+    elif path.suffix.lower() == ".pdf":
+        items = [{"pdf": str(path)}]
+    elif path.suffix.lower() == ".json":
+        items = json.loads(path.read_text(encoding="utf-8"))
+    else:
+        lines = path.read_text(encoding="utf-8").splitlines()
+        items = [{"pdf": line.strip()} for line in lines if line.strip() and not line.startswith("#")]
+
+    base = path if path.is_dir() else path.parent
+    entries = []
+    for item in items:
+        pdf = Path(item["pdf"])
+        if not pdf.is_absolute() and not pdf.exists():
+            pdf = base / pdf
+        entries.append({
+            "pdf": str(pdf),
+            "style": item.get("style", default_style),
+            "job_id": item.get("job_id", ""),
+            "base_job_id": item.get("base_job_id", ""),
+            "output": item.get("output"),
+        })
+    return entries
+
+
+def run_batch(entries, key_pool, output_dir, concurrency=BATCH_CONCURRENCY, upload=False, hf_token="", repo_id=""):
+    """複数PDFをジョブキューとして並行処理
+
+    キャッシュ・APIキープール・レート制御はプロセス全体で共有されるため、
+    同時実行するジョブ間でもクォータを超えない。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"[batch] {len(entries)}件のPDFを処理 (同時実行数={concurrency})")
+
+    # 出力先を先に決める（同名PDFが別ディレクトリにあっても衝突しないようジョブIDを付ける）
+    jobs = []
+    claimed = set()
+    for entry in entries:
+        job_id, pdf_sha256 = resolve_job_id(entry["pdf"], entry["style"], entry["job_id"])
+        output_path = entry["output"] or os.path.join(output_dir, f"{Path(entry['pdf']).stem}_{job_id}.mp4")
+        duplicate = os.path.abspath(output_path) in claimed
+        claimed.add(os.path.abspath(output_path))
+        jobs.append((entry, job_id, pdf_sha256, output_path, duplicate))
+
+    def run_one(job):
+        entry, job_id, pdf_sha256, output_path, duplicate = job
+        pdf_path = entry["pdf"]
+        if duplicate:
+            # 同じ動画・結合リスト・レポートを書き合わないよう後続のエントリは実行しない
+            print(f"[batch] 失敗: {pdf_path}: 出力先 {output_path} が他のエントリと重複")
+            return {"pdf": pdf_path, "status": "error", "job_id": job_id,
+                    "error": f"出力先が他のエントリと重複しています: {output_path}"}
+        trace = RunTrace(job_id)
+        try:
+            result = convert_pdf(pdf_path, entry["style"], key_pool, job_id, pdf_sha256, output_path=output_path,
+                                 trace=trace, base_job_id=entry.get("base_job_id", ""))
+            if upload:
+                with trace.stage("upload") as record:
+                    record["bytes"] = os.path.getsize(output_path)
+                    result["hf_url"] = upload_to_hf_dataset(output_path, hf_token, repo_id,
+                                                            name=f"{Path(pdf_path).stem}_{job_id}")
+            result["report"] = trace.write(run_report_path(output_path), total_pages=result["total_pages"])
+            result["stages"] = trace.summary()
+            print(f"[batch] 完了: {pdf_path} → {output_path}")
+            return {"pdf": pdf_path, "status": "ok", **result}
+        except Exception as e:
+            print(f"[batch] 失敗: {pdf_path}: {e}")
+            print(traceback.format_exc())
+            return {"pdf": pdf_path, "status": "error", "job_id": job_id, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run_one, jobs))
+
+    failed = sum(1 for r in results if r["status"] != "ok")
+    print(f"[batch] 全件終了: 成功 {len(results) - failed} / 失敗 {failed}")
+    return results
+
+
+def main(argv=None):
+    """引数なしでGradio UIを起動、`batch` サブコマンドでヘッドレス一括変換"""
+    parser = argparse.ArgumentParser(description="PDFをナレーション付き動画に変換")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch_parser = subparsers.add_parser("batch", help="複数PDFを一括変換（UIなし）")
+    batch_parser.add_argument("input", help="PDFファイル / ディレクトリ / マニフェスト(.txt, .json)")
+    batch_parser.add_argument("--output-dir", default="outputs", help="動画の出力先ディレクトリ")
+    batch_parser.add_argument("--style", default="1人ラジオ風", choices=list(PROGRAM_STYLES.keys()))
+    batch_parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="同時処理するPDF数")
+    batch_parser.add_argument("--api-key", default="", help="Gemini APIキー（カンマ区切り可、省略時は環境変数）")
+    batch_parser.add_argument("--upload", action="store_true", help="完了した動画をHF Datasetにアップロード")
+    batch_parser.add_argument("--hf-token", default=ENV_HF_TOKEN)
+    batch_parser.add_argument("--hf-repo-id", default=ENV_HF_REPO_ID)
+    batch_parser.add_argument("--report", help="結果一覧をJSONで保存するパス")
+
+    args = parser.parse_args(argv)
+
+    if args.command != "batch":
+        demo = create_demo()
+        demo.launch(server_name="0.0.0.0", server_port=7860, ssr_mode=False, allowed_paths=[JOBS_DIR])
+        return 0
+
+    api_keys = parse_api_keys(args.api_key) or ENV_GEMINI_API_KEYS
+    if not api_keys:
+        parser.error("Gemini APIキーが必要です（--api-key または GEMINI_API_KEY）")
+    if args.upload and not args.hf_token:
+        parser.error("--upload にはHFトークンが必要です（--hf-token または HF_TOKEN）")
+
+    entries = load_batch_entries(args.input, args.style)
+    results = run_batch(
+        entries, ApiKeyPool(api_keys), args.output_dir, concurrency=args.concurrency,
+        upload=args.upload, hf_token=args.hf_token, repo_id=args.hf_repo_id
+    )
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    return 0 if all(r["status"] == "ok" for r in results) else 1
 
 
 # ===========================
@@ -733,7 +2491,7 @@ def create_demo():
                 )
 
                 gemini_key = gr.Textbox(
-                    label="Gemini API Key",
+                    label="Gemini API Key（カンマ区切りで複数可）",
                     type="password",
                     placeholder="環境変数設定済みなら空欄可"
                 )
@@ -749,22 +2507,36 @@ def create_demo():
                     value=ENV_HF_REPO_ID
                 )
 
+                job_id_input = gr.Textbox(
+                    label="ジョブID（再開用）",
+                    placeholder="空欄ならPDFとスタイルから自動生成（同じPDFは続きから再開）"
+                )
+
+                base_job_id_input = gr.Textbox(
+                    label="前回のジョブID（差分再生成用）",
+                    placeholder="空欄なら過去のジョブから未変更ページを自動で探して再利用"
+                )
+
                 generate_btn = gr.Button("動画生成", variant="primary")
 
             with gr.Column():
+                preview_output = gr.Video(label="プレビュー（完成したページから再生）", streaming=True, autoplay=True)
                 video_output = gr.Video(label="生成動画")
                 status_output = gr.Textbox(label="ステータス", lines=10)
                 hf_url_output = gr.Textbox(label="HF URL")
 
         generate_btn.click(
             fn=process_pdf_to_movie,
-            inputs=[pdf_input, program_style, gemini_key, hf_token, hf_repo],
-            outputs=[video_output, status_output, hf_url_output]
+            inputs=[pdf_input, program_style, gemini_key, hf_token, hf_repo, job_id_input, base_job_id_input],
+            outputs=[preview_output, video_output, status_output, hf_url_output],
+            concurrency_limit=UI_CONCURRENCY_LIMIT,
+            concurrency_id="convert"
         )
 
+    # ジョブ待ち行列（上限超過時は受付拒否）。Geminiクォータとエンコード枠は全ジョブで共有
+    demo.queue(max_size=UI_MAX_QUEUE_SIZE)
     return demo
 
 
 if __name__ == "__main__":
-    demo = create_demo()
-    demo.launch(server_name="0.0.0.0", server_port=7860, ssr_mode=False)
+    sys.exit(main())
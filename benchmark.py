@@ -0,0 +1,281 @@
+"""オフラインベンチマーク（Gemini APIをスタブに差し替えてパイプライン全体を計測）
+
+使い方:
+    python benchmark.py                                  # 5/50/500ページ
+    python benchmark.py --pages 5 50 --latency 0.5 --error-rate 0.05
+    python benchmark.py --style 2人ポッドキャスト風 --warm --output bench.json
+
+台本生成・TTSはローカルのスタブが応答する（定型JSON台本、台本の長さに
+見合った合成PCM、遅延と429エラーの注入）。合成PDFを実際のパイプライン
+（分割→台本→TTS→音声処理→エンコード→結合）に通し、スループット・
+ピークRSS・ステージ別時間を出力する。ピークRSSを分離するため各ケースは
+子プロセスで実行する。ffmpegが必要（APIキー・ネットワークは不要）。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types as _types
+
+import numpy as np
+
+CHARS_PER_SECOND = 8  # 合成音声の読み上げ速度（日本語の文字数/秒）
+
+
+# ===========================
+# Geminiスタブ
+# ===========================
+class StubAPIError(Exception):
+    """429 RESOURCE_EXHAUSTED を模した例外（retryDelay付き）"""
+
+    def __init__(self, retry_delay):
+        super().__init__(f"429 RESOURCE_EXHAUSTED. {{'retryDelay': '{retry_delay}s'}}")
+        self.code = 429
+
+
+class StubModels:
+    """genai.Client().models の代替（generate_contentのみ）"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_content(self, model, contents, config):
+        return self.backend.respond(model, contents)
+
+
+class StubBackend:
+    """遅延・429注入付きのスタブ応答とリクエスト数の集計"""
+
+    def __init__(self, latency, jitter, error_rate, retry_delay, seconds_per_page, sample_rate):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_delay = retry_delay
+        self.seconds_per_page = seconds_per_page
+        self.sample_rate = sample_rate
+        self.calls = {"script": 0, "tts": 0, "rate_limited": 0}
+        self.lock = threading.Lock()
+
+    def client(self, api_key=None, **kwargs):
+        return _types.SimpleNamespace(models=StubModels(self))
+
+    def respond(self, model, contents):
+        kind = "tts" if "tts" in model else "script"
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        with self.lock:
+            if random.random() < self.error_rate:
+                self.calls["rate_limited"] += 1
+                raise StubAPIError(self.retry_delay)
+            self.calls[kind] += 1
+        if kind == "tts":
+            return self.tts_response(contents)
+        return self.script_response(contents)
+
+    def script_response(self, contents):
+        """プロンプト中の対象ページ番号に対して定型の台本を返す"""
+        prompt = contents[0].parts[-1].text
+        pages = json.loads(re.search(r"対象ページ番号: (\[.*?\])", prompt).group(1))
+        sentence = "このページでは資料の要点を順に説明します。"
+        body = sentence * max(1, int(self.seconds_per_page * CHARS_PER_SECOND / len(sentence)))
+        if "dialogue" in prompt:
+            half = body[:len(body) // 2]
+            speakers = re.findall(r"「(.+?)」または「(.+?)」", prompt)[0]
+            pages_data = [
+                {"page_number": p, "dialogue": [{"speaker": speakers[0], "text": f"ページ{p}。{half}"},
+                                                {"speaker": speakers[1], "text": half}]}
+                for p in pages
+            ]
+        else:
+            # ページごとに文面を変える（TTSキャッシュで重複排除されないように）
+            pages_data = [{"page_number": p, "narration": f"ページ{p}。{body}"} for p in pages]
+        return _types.SimpleNamespace(text=json.dumps({"pages": pages_data}, ensure_ascii=False))
+
+    def tts_response(self, contents):
+        """読み上げ対象の文字数に見合った長さのPCM（ページ区切りは3秒の無音）"""
+        import app
+
+        text = re.split(r"以下のテキストを読み上げてください:|会話:", contents)[-1]
+        parts = text.split(app.TTS_PAGE_BREAK)
+        silence = np.zeros(self.sample_rate * 3, dtype=np.int16)
+        pieces = []
+        for i, part in enumerate(parts):
+            if i:
+                pieces.append(silence)
+            n = int(len(part.strip()) / CHARS_PER_SECOND * self.sample_rate)
+            tone = np.sin(np.arange(n) * 2 * np.pi * 220 / self.sample_rate) * 3000
+            pieces.append(tone.astype(np.int16))
+        pcm = np.concatenate(pieces).tobytes()
+        part = _types.SimpleNamespace(inline_data=_types.SimpleNamespace(data=pcm))
+        return _types.SimpleNamespace(candidates=[_types.SimpleNamespace(content=_types.SimpleNamespace(parts=[part]))])
+
+
+# ===========================
+# 合成PDF
+# ===========================
+def make_pdf(path, n_pages):
+    """テキストと図形を含むスライド風PDFを作成"""
+    import fitz
+
+    doc = fitz.open()
+    for i in range(n_pages):
+        page = doc.new_page(width=960, height=540)
+        page.insert_text((60, 80), f"Benchmark slide {i + 1} / {n_pages}", fontsize=32)
+        for line in range(6):
+            page.insert_text((80, 150 + line * 40), f"- bullet {line + 1}: sample text for page {i + 1}", fontsize=18)
+        color = ((i * 37) % 255 / 255, (i * 91) % 255 / 255, 0.6)
+        page.draw_rect(fitz.Rect(640, 150, 900, 450), color=color, fill=color)
+    doc.save(path)
+    doc.close()
+    return path
+
+
+# ===========================
+# 1ケースの実行（子プロセス）
+# ===========================
+def run_case(args):
+    """合成PDFをパイプラインに通し、計測結果をdictで返す"""
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    os.environ["JOBS_DIR"] = os.path.join(work_dir, "jobs")
+    os.environ["CACHE_DIR"] = os.path.join(work_dir, "cache")
+    assert "app" not in sys.modules, "JOBS_DIR/CACHE_DIRを設定する前にappが読み込まれています"
+    import app
+
+    backend = StubBackend(args.latency, args.jitter, args.error_rate, args.retry_delay,
+                          args.seconds_per_page, app.TTS_SAMPLE_RATE)
+    app.genai.Client = backend.client
+    app.SCRIPT_RPM = args.rpm
+    app.TTS_RPM = args.rpm
+    for assignment in args.set or []:
+        name, value = assignment.split("=", 1)
+        current = getattr(app, name)
+        setattr(app, name, value == "True" if isinstance(current, bool) else type(current)(value))
+
+    pdf_path = make_pdf(os.path.join(work_dir, f"bench_{args.case}.pdf"), args.case)
+    key_pool = app.ApiKeyPool([f"bench-key-{i}" for i in range(args.keys)])
+
+    runs = []
+    for label in (["cold", "warm"] if args.warm else ["cold"]):
+        if label == "warm":
+            app.INCREMENTAL_RENDER = False  # 差分再生成ではなくキャッシュ経由の再実行を測る
+        job_id, pdf_sha256 = app.resolve_job_id(pdf_path, args.style, f"bench_{label}")
+        trace = app.RunTrace(job_id)
+        calls_before = dict(backend.calls)
+        start = time.perf_counter()
+        result = app.convert_pdf(pdf_path, args.style, key_pool, job_id, pdf_sha256, trace=trace)
+        elapsed = time.perf_counter() - start
+        runs.append({
+            "run": label,
+            "wall_seconds": round(elapsed, 2),
+            "pages_per_second": round(args.case / elapsed, 3),
+            "video_bytes": os.path.getsize(result["video_path"]),
+            "api_calls": {k: backend.calls[k] - calls_before[k] for k in backend.calls},
+            "retry_count": result["retry_count"],
+            "retry_wait": round(result["retry_wait"], 1),
+            "stages": trace.summary(),
+        })
+
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "pages": args.case,
+        "style": args.style,
+        "render_mode": app.RENDER_MODE,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "work_dir": work_dir if args.keep else None,
+        "runs": runs,
+    }
+
+
+# ===========================
+# 集計・表示
+# ===========================
+def print_table(results):
+    print()
+    print(f"{'pages':>6} {'run':>5} {'wall[s]':>9} {'pages/s':>8} {'RSS[MB]':>8} {'API':>6} {'429':>4}")
+    for case in results:
+        for run in case["runs"]:
+            calls = run["api_calls"]
+            print(f"{case['pages']:>6} {run['run']:>5} {run['wall_seconds']:>9.2f} {run['pages_per_second']:>8.2f} "
+                  f"{case['peak_rss_mb']:>8.1f} "
+                  f"{calls['script'] + calls['tts']:>6} {calls['rate_limited']:>4}")
+    print()
+    for case in results:
+        for run in case["runs"]:
+            print(f"[{case['pages']}ページ / {run['run']}] ステージ別時間（合計秒 / 件数）")
+            for name, entry in run["stages"].items():
+                print(f"    {name:<28} {entry['seconds']:>9.2f}s  x{entry['count']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スタブGeminiでPDF→動画パイプラインを計測")
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 50, 500], help="合成PDFのページ数")
+    parser.add_argument("--style", default="1人ラジオ風", help="番組スタイル名（app.PROGRAM_STYLESのキー）")
+    parser.add_argument("--latency", type=float, default=0.2, help="スタブ応答の平均遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="遅延の揺らぎ（±秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--retry-delay", type=float, default=1.0, help="429に付けるretryDelay（秒）")
+    parser.add_argument("--seconds-per-page", type=float, default=30.0, help="1ページあたりの合成音声の長さ")
+    parser.add_argument("--rpm", type=int, default=60000, help="キーあたりのRPM上限（既定は実質無制限）")
+    parser.add_argument("--keys", type=int, default=1, help="スタブAPIキーの本数")
+    parser.add_argument("--warm", action="store_true", help="キャッシュが温まった状態での再実行も計測")
+    parser.add_argument("--set", action="append", metavar="NAME=VALUE", help="app.pyの設定を上書き（例: RENDER_MODE=single_pass）")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--keep", action="store_true", help="作業ディレクトリ（動画・レポート）を残す")
+    parser.add_argument("--verbose", action="store_true", help="パイプラインのログを表示")
+    parser.add_argument("--case", type=int, help=argparse.SUPPRESS)  # 子プロセス用
+    args = parser.parse_args(argv)
+
+    if args.case:
+        result = run_case(args)
+        print("BENCH_RESULT " + json.dumps(result, ensure_ascii=False))
+        return 0
+
+    # 子プロセスはrun_caseで作業ディレクトリを設定してからappを読み込むため、検証は親側だけで行う
+    from app import PROGRAM_STYLES
+
+    if args.style not in PROGRAM_STYLES:
+        parser.error(f"--style: 不明な番組スタイル '{args.style}'（選択肢: {', '.join(PROGRAM_STYLES)}）")
+
+    child_args = [a for a in (argv if argv is not None else sys.argv[1:])]
+    if "--pages" in child_args:
+        i = child_args.index("--pages")
+        j = i + 1
+        while j < len(child_args) and not child_args[j].startswith("--"):
+            j += 1
+        del child_args[i:j]
+
+    results = []
+    for n_pages in args.pages:
+        print(f"[bench] {n_pages}ページ実行中...", flush=True)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *child_args, "--case", str(n_pages)],
+            capture_output=True, text=True
+        )
+        if args.verbose:
+            print(proc.stdout)
+        marker = [line for line in proc.stdout.splitlines() if line.startswith("BENCH_RESULT ")]
+        if proc.returncode != 0 or not marker:
+            print(proc.stdout[-2000:])
+            print(proc.stderr[-2000:])
+            print(f"[bench] {n_pages}ページのケースが失敗しました")
+            return 1
+        results.append(json.loads(marker[-1][len("BENCH_RESULT "):]))
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"[bench] 結果を保存: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())